@@ -0,0 +1,235 @@
+import hashlib
+import io
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from compliance_qa.retrieval_backends import LocalVectorBackend, LocalVectorIndex
+
+
+#Local stand-ins for the Bedrock runtime and OpenSearch clients the Streamlit scripts create at import time
+#Answers are deterministic functions of the request, so two runs of the benchmark do the same work:
+#Titan embeddings are normalized sums of per-word random vectors (texts sharing words are close), Haiku returns
+#keywords picked from the question and Claude answers with a fixed number of tokens
+#Latency is injected per call and Bedrock throttles like the real per-model TPS quota
+
+
+TITAN_DIMENSIONS = 1536
+WORD = re.compile(r"\w+")
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "do", "does", "for", "from", "how", "i", "in", "is", "it",
+             "of", "on", "or", "the", "to", "under", "what", "when", "which", "with"}
+
+
+class Latency:
+    #base_ms plus a uniformly distributed extra of up to jitter_ms per call
+
+    def __init__(self, base_ms=0, jitter_ms=0, seed=0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def wait(self, scale=1):
+        if not self.base_ms and not self.jitter_ms:
+            return
+        with self.lock:
+            extra = self.random.random() * self.jitter_ms
+        time.sleep((self.base_ms + extra) * scale / 1000)
+
+
+class Quota:
+    #Requests per second allowed for one model, None for unlimited; over quota raises ThrottlingException
+
+    def __init__(self, max_tps=None):
+        self.max_tps = max_tps
+        self.lock = threading.Lock()
+        self.tokens = max_tps or 0
+        self.updated = time.monotonic()
+
+    def take(self):
+        if not self.max_tps:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.max_tps, self.tokens + (now - self.updated) * self.max_tps)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Counters:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def words(text):
+    return [word for word in WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class FakeBedrock:
+
+    def __init__(self, latency=None, token_latency=None, embedding_tps=None, llm_tps=None, answer_tokens=200):
+        self.latency = latency or Latency()
+        self.token_latency = token_latency or Latency()
+        self.quotas = {"titan": Quota(embedding_tps), "claude": Quota(llm_tps)}
+        self.answer_tokens = answer_tokens
+        self.counters = Counters()
+        self.word_vectors = {}
+        self.lock = threading.Lock()
+
+    def embed(self, text, dimensions=TITAN_DIMENSIONS):
+        vector = np.zeros(TITAN_DIMENSIONS, dtype=np.float32)
+        for word in words(text) or [text]:
+            with self.lock:
+                word_vector = self.word_vectors.get(word)
+            if word_vector is None:
+                word_vector = np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(TITAN_DIMENSIONS).astype(np.float32)
+                with self.lock:
+                    self.word_vectors[word] = word_vector
+            vector += word_vector
+        vector = vector[:dimensions]  #Titan v2's reduced sizes
+        return vector / max(float(np.linalg.norm(vector)), 1e-6)
+
+    def _call(self, modelId, operation):
+        family = "titan" if "titan" in modelId else "claude"
+        self.counters.add(f"{operation}:{modelId}")
+        if not self.quotas[family].take():
+            self.counters.add(f"throttled:{modelId}")
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, operation)
+        self.latency.wait()
+
+    def _response(self, body):
+        return {
+            "body": io.BytesIO(json.dumps(body).encode("utf-8")),
+            "ResponseMetadata": {"RequestId": str(uuid.uuid4()), "HTTPStatusCode": 200},
+        }
+
+    def _answer(self, body):
+        seed = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        return [f"{seed[i % 40]}word{i} " for i in range(self.answer_tokens)]
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        self._call(modelId, "InvokeModel")
+        request = json.loads(body)
+
+        if "titan" in modelId:
+            return self._response({"embedding": self.embed(request["inputText"], request.get("dimensions", TITAN_DIMENSIONS)).tolist(),
+                                   "inputTextTokenCount": len(request["inputText"]) // 4 + 1})
+
+        question = re.sub(r"</?user_question>", "", request["messages"][0]["content"][0]["text"])
+        usage = {"input_tokens": len(body) // 4 + 1}
+        if "haiku" in modelId:
+            picked = words(question) or ["compliance"]
+            text = (f"<keyword_1>{picked[0]}</keyword_1><keyword_2>{' '.join(picked[:3])}</keyword_2>"
+                    f"<keyword_3>{' '.join(picked[:5])}</keyword_3>")
+            usage["output_tokens"] = 30
+        else:
+            answer = self._answer(body)
+            self.token_latency.wait(len(answer))
+            text = "".join(answer)
+            usage["output_tokens"] = len(answer)
+        return self._response({"content": [{"type": "text", "text": text}], "usage": usage})
+
+    def invoke_model_with_response_stream(self, body, modelId, accept=None, contentType=None):
+        self._call(modelId, "InvokeModelWithResponseStream")
+        answer = self._answer(body)
+
+        def events():
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start"}).encode("utf-8")}}
+            for token in answer:
+                self.token_latency.wait()
+                delta = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": token}}
+                yield {"chunk": {"bytes": json.dumps(delta).encode("utf-8")}}
+            stop = {"type": "message_stop", "amazon-bedrock-invocationMetrics": {
+                "inputTokenCount": len(body) // 4 + 1, "outputTokenCount": len(answer)}}
+            yield {"chunk": {"bytes": json.dumps(stop).encode("utf-8")}}
+
+        return {"body": events(), "ResponseMetadata": {"RequestId": str(uuid.uuid4()), "HTTPStatusCode": 200}}
+
+
+class FakeOpenSearch:
+    #In-memory indexes answering the same kNN/match/ids bodies as AOSS, through retrieval_backends.LocalVectorBackend
+    #Each index name gets its own store, so a vector index split from its content index behaves like it does in AOSS
+    #bulk_throttle_rate is the fraction of bulk items rejected with 429
+
+    def __init__(self, latency=None, bulk_throttle_rate=0.0, seed=0):
+        self.latency = latency or Latency()
+        self.bulk_throttle_rate = bulk_throttle_rate
+        self.random = random.Random(seed)
+        self.counters = Counters()
+        self.directory = tempfile.TemporaryDirectory(prefix="bench-index-")
+        self.backends = {}
+        self.lock = threading.Lock()
+
+    def backend(self, index):
+        with self.lock:
+            if index not in self.backends:
+                self.backends[index] = LocalVectorBackend(LocalVectorIndex(f"{self.directory.name}/{len(self.backends)}"))
+            return self.backends[index]
+
+    def _store(self, index, doc_id, document):
+        #Content index documents have no vectors, they get a placeholder the kNN queries never reach
+        self.backend(index).index.add(doc_id, document.get("vectors", [0.0]), document.get("content", ""), document["source"], document["page"])
+
+    def search(self, body, index=None, **kwargs):
+        self.counters.add("search")
+        self.latency.wait()
+        response = self.backend(index).search(body)
+        response["took"] = 1
+        return response
+
+    def msearch(self, body, index=None, **kwargs):
+        self.counters.add("msearch")
+        self.latency.wait()
+        return {"responses": [dict(self.backend(header.get("index", index)).search(query), took=1) for header, query in zip(body[0::2], body[1::2])]}
+
+    def index(self, index, body, id=None, **kwargs):
+        self.counters.add("index")
+        self.latency.wait()
+        doc_id = id or uuid.uuid4().hex
+        self._store(index, doc_id, body)
+        return {"_id": doc_id, "result": "created"}
+
+    def bulk(self, body, **kwargs):
+        self.counters.add("bulk")
+        self.latency.wait()
+        items = []
+        position = 0
+        while position < len(body):
+            action = body[position]
+            operation, meta = next(iter(action.items()))
+            doc_id = meta.get("_id") or uuid.uuid4().hex
+            document = body[position + 1] if operation != "delete" else None
+            position += 1 if operation == "delete" else 2
+
+            if self.random.random() < self.bulk_throttle_rate:
+                self.counters.add("bulk_throttled")
+                items.append({operation: {"_id": doc_id, "status": 429, "error": {"type": "throttled"}}})
+                continue
+            if operation == "delete":
+                self.backend(meta["_index"]).index.delete(doc_id)
+            else:
+                self._store(meta["_index"], doc_id, document)
+            items.append({operation: {"_id": doc_id, "status": 201}})
+        return {"took": 1, "errors": any(next(iter(item.values()))["status"] >= 300 for item in items), "items": items}
@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+from botocore.credentials import Credentials
+
+from compliance_qa import ingest, qa, resources
+from compliance_qa.tracing import nearest_rank
+from fakes import FakeBedrock, FakeOpenSearch, Latency
+
+
+#Offline benchmark for compliance_qa's Q&A and document ingest
+#qa.do_it and the ingest functions run unchanged against the stand-in clients in fakes.py, so the numbers cover the
+#real code paths (caches, thread pools, rate limiter, bulk indexer, fusion, packing) minus the network
+#For every corpus size the corpus is ingested once, then the same questions are asked at every concurrency level,
+#each level with empty embedding/answer caches
+#
+#   python bench/run_benchmark.py --corpus-sizes 200 2000 --concurrency 1 4 16 --bedrock-latency-ms 80
+#
+#Timings depend on the machine, compare runs made on the same one
+
+
+VOCABULARY = """
+trade report reporting counterparty obligation regulation article transaction derivative position notification
+collateral margin clearing exposure valuation lifecycle submission rejection reconciliation field identifier entity
+venue instrument threshold exemption deadline competent authority supervisor filing disclosure record keeping
+client classification eligible hedging risk mitigation confirmation dispute portfolio compression backloading
+""".split()
+IDENTIFIERS = ["EMIR", "MiFIR", "SFTR", "LEI", "UTI", "ISIN", "NCA", "ESMA", "RTS", "ITS", "CON-411", "EMIR_VAL_023"]
+
+
+class FakeSession:
+
+    def get_credentials(self):
+        return Credentials("bench", "bench")
+
+
+@contextlib.contextmanager
+def fake_clients(bedrock, opensearch, environment):
+    #compliance_qa.resources builds its clients through boto3/opensearch-py, which hand back the fakes here
+    #Resources are dropped before and after, so every phase gets its own caches under environment's paths
+    resources.clear_all()
+    try:
+        with mock.patch.dict(os.environ, environment), \
+                mock.patch("boto3.client", return_value=bedrock), \
+                mock.patch("boto3.Session", return_value=FakeSession()), \
+                mock.patch("opensearchpy.OpenSearch", return_value=opensearch), \
+                contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        resources.clear_all()
+
+
+def synthetic_corpus(chunks, pages_per_file=50, words_per_page=250, seed=0):
+    #Returns {file name: [page text, ...]} with Zipf-distributed vocabulary, so some terms are common and some rare
+    rng = random.Random(seed)
+    vocabulary = VOCABULARY + [f"term{i}" for i in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    corpus = {}
+    for page in range(chunks):
+        words = rng.choices(vocabulary, weights, k=words_per_page)
+        for position in rng.sample(range(words_per_page), 3):
+            words[position] = rng.choice(IDENTIFIERS)
+        text = ". ".join(" ".join(words[i:i + 15]) for i in range(0, words_per_page, 15)) + "."
+        corpus.setdefault(f"document_{page // pages_per_file:04d}.pdf", []).append(text)
+    return corpus
+
+
+def synthetic_questions(corpus, count, seed=0):
+    #Questions are built from phrases of random pages, so retrieval has something to find
+    rng = random.Random(seed)
+    pages = [page for pages in corpus.values() for page in pages]
+    questions = []
+    for _ in range(count):
+        sentence = rng.choice(rng.choice(pages).split(". "))
+        words = sentence.split()
+        start = rng.randrange(max(len(words) - 6, 1))
+        questions.append(f"What are the {' '.join(words[start:start + 6])} requirements?")
+    return questions
+
+
+def write_workbook(path, rows, seed=0):
+    rng = random.Random(seed)
+    frame = pd.DataFrame({
+        "Field": [rng.choice(VOCABULARY) for _ in range(rows)],
+        "Code": [rng.choice(IDENTIFIERS) for _ in range(rows)],
+        "Description": [" ".join(rng.choices(VOCABULARY, k=12)) for _ in range(rows)],
+        "Mandatory": [rng.choice(["Y", "N", None]) for _ in range(rows)],
+    })
+    frame.to_excel(path, sheet_name="Validations", index=False)
+
+
+def difference(after, before):
+    return {key: after.get(key, 0) - before.get(key, 0) for key in after if after.get(key, 0) != before.get(key, 0)}
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    return {f"p{p}_ms": round(nearest_rank(ordered, p), 1) for p in (50, 95, 99)}
+
+
+@contextlib.contextmanager
+def measured(result):
+    #Fills result with wall time and tracemalloc peak (Python allocations, NumPy arrays included)
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        result["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+
+
+def run_ingest(corpus, bedrock, opensearch, environment, excel_rows):
+    bedrock_before, opensearch_before = bedrock.counters.snapshot(), opensearch.counters.snapshot()
+    chunks = sum(len(pages) for pages in corpus.values())
+    result = {"phase": "ingest", "chunks": chunks}
+
+    workbook = os.path.join(environment["BENCH_DIRECTORY"], "validations.xlsx")
+    if excel_rows:
+        write_workbook(workbook, excel_rows)
+
+    with fake_clients(bedrock, opensearch, environment), measured(result):
+        for file_name, pages in corpus.items():
+            #The chunk tuples iter_pdf_chunks yields for a parsed PDF
+            ingest.index_chunks(file_name, ((text, file_name, page, 0, f"Page: {page}") for page, text in enumerate(pages)))
+        if excel_rows:
+            ingest.process_excel(workbook, "validations.xlsx")
+
+    result["chunks_per_second"] = round(chunks / max(result["seconds"], 1e-9), 1)
+    result["bedrock_requests"] = difference(bedrock.counters.snapshot(), bedrock_before)
+    result["opensearch_requests"] = difference(opensearch.counters.snapshot(), opensearch_before)
+    return result
+
+
+def run_questions(questions, concurrency, bedrock, opensearch, environment, stream):
+    bedrock_before, opensearch_before = bedrock.counters.snapshot(), opensearch.counters.snapshot()
+    result = {"phase": "questions", "concurrency": concurrency, "questions": len(questions), "stream": stream}
+
+    def ask(question):
+        started = time.perf_counter()
+        first_token = None
+        if stream:
+            for _ in qa.do_it_stream(question):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+        else:
+            qa.do_it(question)
+        return (time.perf_counter() - started) * 1000, (first_token or 0) * 1000
+
+    with fake_clients(bedrock, opensearch, environment), measured(result):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = list(executor.map(ask, questions))
+        stages = qa.trace_recorder().percentiles()
+
+    result["questions_per_second"] = round(len(questions) / max(result["seconds"], 1e-9), 2)
+    result["latency"] = percentiles([total for total, _ in timings])
+    if stream:
+        result["time_to_first_token"] = percentiles([first for _, first in timings])
+    result["bedrock_requests_per_question"] = {key: round(count / len(questions), 2) for key, count in difference(bedrock.counters.snapshot(), bedrock_before).items()}
+    result["opensearch_requests_per_question"] = {key: round(count / len(questions), 2) for key, count in difference(opensearch.counters.snapshot(), opensearch_before).items()}
+    result["stages"] = stages
+    return result
+
+
+def print_result(result):
+    if result["phase"] == "ingest":
+        print(f"  ingest  {result['chunks']} chunks in {result['seconds']}s  {result['chunks_per_second']} chunks/s  "
+              f"peak {result['peak_memory_mb']} MB")
+        print(f"          bedrock {result['bedrock_requests']}  opensearch {result['opensearch_requests']}")
+        return
+
+    latency = result["latency"]
+    print(f"  concurrency {result['concurrency']:>3}  {result['questions_per_second']} q/s  p50 {latency['p50_ms']} ms  "
+          f"p95 {latency['p95_ms']} ms  p99 {latency['p99_ms']} ms  peak {result['peak_memory_mb']} MB")
+    if "time_to_first_token" in result:
+        print(f"          time to first token p50 {result['time_to_first_token']['p50_ms']} ms  p95 {result['time_to_first_token']['p95_ms']} ms")
+    print(f"          per question: bedrock {result['bedrock_requests_per_question']}  opensearch {result['opensearch_requests_per_question']}")
+    for stage, summary in sorted(result["stages"].items()):
+        print(f"          {stage:<28} p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document ingest and Q&A against local Bedrock/OpenSearch stand-ins")
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[200, 2000], help="chunks to ingest per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="questions in flight at once")
+    parser.add_argument("--questions", type=int, default=40, help="questions asked at every concurrency level")
+    parser.add_argument("--excel-rows", type=int, default=5000, help="rows of the workbook ingested with process_excel, 0 to skip")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=50)
+    parser.add_argument("--bedrock-jitter-ms", type=float, default=20)
+    parser.add_argument("--token-latency-ms", type=float, default=2, help="per output token of the answer")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--opensearch-latency-ms", type=float, default=20)
+    parser.add_argument("--opensearch-jitter-ms", type=float, default=10)
+    parser.add_argument("--embedding-tps", type=float, default=None, help="Titan quota, throttles above it")
+    parser.add_argument("--llm-tps", type=float, default=None, help="Claude quota, throttles above it")
+    parser.add_argument("--bulk-throttle-rate", type=float, default=0.0, help="fraction of bulk items rejected with 429")
+    parser.add_argument("--stream", action="store_true", help="ask through do_it_stream and report time to first token")
+    parser.add_argument("--local-keywords", action="store_true", help="qa.LOCAL_KEYWORDS on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write every result to this file")
+    args = parser.parse_args()
+
+    qa.LOCAL_KEYWORDS = args.local_keywords
+    qa.RETRIEVAL_BACKEND = "opensearch"
+    results = []
+    for corpus_size in args.corpus_sizes:
+        print(f"corpus of {corpus_size} chunks")
+        corpus = synthetic_corpus(corpus_size, seed=args.seed)
+        questions = synthetic_questions(corpus, args.questions, seed=args.seed)
+        bedrock = FakeBedrock(
+            latency=Latency(args.bedrock_latency_ms, args.bedrock_jitter_ms, seed=args.seed),
+            token_latency=Latency(args.token_latency_ms, seed=args.seed),
+            embedding_tps=args.embedding_tps,
+            llm_tps=args.llm_tps,
+            answer_tokens=args.answer_tokens,
+        )
+        opensearch = FakeOpenSearch(Latency(args.opensearch_latency_ms, args.opensearch_jitter_ms, seed=args.seed),
+                                    bulk_throttle_rate=args.bulk_throttle_rate, seed=args.seed)
+
+        with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+            def environment(name):
+                return {
+                    "BENCH_DIRECTORY": directory,
+                    "EMBEDDING_CACHE_PATH": os.path.join(directory, f"{name}_embedding_cache.sqlite3"),
+                    "ANSWER_CACHE_PATH": os.path.join(directory, f"{name}_answer_cache.sqlite3"),
+                    "INGEST_MANIFEST_PATH": os.path.join(directory, "ingest_manifest.sqlite3"),
+                    "TERM_STATS_PATH": os.path.join(directory, "term_stats.sqlite3"),
+                    "TRACE_LOG_PATH": "",
+                    "LOCAL_INDEX_PATH": "",
+                }
+
+            result = run_ingest(corpus, bedrock, opensearch, environment("ingest"), args.excel_rows)
+            result["corpus_size"] = corpus_size
+            print_result(result)
+            results.append(result)
+
+            for concurrency in args.concurrency:
+                result = run_questions(questions, concurrency, bedrock, opensearch, environment(f"qa_{concurrency}"), args.stream)
+                result["corpus_size"] = corpus_size
+                print_result(result)
+                results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
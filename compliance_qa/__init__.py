@@ -0,0 +1,3 @@
+#Retrieval and ingest logic behind the Compliance Q+A Streamlit pages
+#qa.do_it / qa.do_it_stream answer a question, ingest.process_files indexes an uploaded file
+#Clients and caches are created on first use (see resources.py), so importing the package is cheap
@@ -0,0 +1,199 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+#Semantic answer cache for the Q&A script
+#Answers are looked up by the query embedding do_it already computes, so a hit skips retrieval and the Sonnet call
+#The document ingest script records which sources it (re)indexed in the same SQLite file, and cached answers
+#that cited one of those sources are dropped the next time the Q&A side checks for updates
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS source_updates (source TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+    db.commit()
+    return db
+
+
+def mark_sources_updated(path, sources):
+    #Called by the ingest side after a file is indexed, so answers citing it are not served from cache anymore
+    db = connect(path)
+    try:
+        now = time.time()
+        db.executemany(
+            "INSERT OR REPLACE INTO source_updates (source, updated_at) VALUES (?, ?)",
+            [(source, now) for source in sources],
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+INITIAL_CAPACITY = 1024
+
+
+class AnswerCache:
+
+    def __init__(self, path="answer_cache.sqlite3", threshold=0.95, ttl=24 * 60 * 60, max_entries=50000,
+                 projected_dimensions=64, shortlist=8, invalidation_poll=5):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.projected_dimensions = projected_dimensions
+        self.shortlist = shortlist
+        self.invalidation_poll = invalidation_poll
+
+        self.lock = threading.Lock()
+        self.db = connect(path)
+        self.last_invalidation_check = time.time()
+        self.next_invalidation_poll = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        #The vector index is allocated on the first put, once the embedding size is known, and doubles as entries
+        #are added up to max_entries; only the first `used` slots have ever held an entry and only those are searched
+        self.dimensions = None
+        self.projection = None  #fixed random projection used to shortlist candidates quickly
+        self.projected = None   #capacity x projected_dimensions, float32, unit length rows
+        self.vectors = None     #capacity x dimensions, float16, unit length rows for the exact check
+        self.capacity = 0
+        self.used = 0
+        self.expires_at = np.zeros(0)
+        self.last_used = np.zeros(0)
+        self.occupied = np.zeros(0, dtype=bool)
+        self.entries = []  #(question, answer, sources) per slot
+        self.slots_by_source = {}
+
+    def get(self, query_vector):
+        with self.lock:
+            self._apply_source_updates()
+
+            slot = self._nearest(query_vector)
+            if slot is None:
+                self.misses += 1
+                return None
+
+            self.last_used[slot] = time.time()
+            self.hits += 1
+            return self.entries[slot][1]
+
+    def put(self, query_vector, question, answer, sources):
+        with self.lock:
+            if self.dimensions is None:
+                self._allocate(len(query_vector))
+
+            now = time.time()
+            used = self.used
+            free = np.flatnonzero(~self.occupied[:used] | (self.expires_at[:used] <= now))
+            if len(free):
+                slot = int(free[0])
+            elif used < self.max_entries:
+                if used == self.capacity:
+                    self._grow()
+                slot = used
+                self.used += 1
+            else:
+                slot = int(np.argmin(self.last_used))
+            self._release(slot)
+
+            vector = self._normalize(query_vector)
+            self.vectors[slot] = vector
+            self.projected[slot] = self._normalize(vector @ self.projection)
+            self.expires_at[slot] = now + self.ttl
+            self.last_used[slot] = now
+            self.occupied[slot] = True
+            self.entries[slot] = (question, answer, sorted(sources))
+            for source in sources:
+                self.slots_by_source.setdefault(source, set()).add(slot)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": int(self.occupied[:self.used].sum()),
+            }
+
+    def _allocate(self, dimensions):
+        self.dimensions = dimensions
+        rng = np.random.default_rng(0)
+        self.projection = rng.standard_normal((dimensions, self.projected_dimensions)).astype(np.float32)
+        self.projected = np.zeros((0, self.projected_dimensions), dtype=np.float32)
+        self.vectors = np.zeros((0, dimensions), dtype=np.float16)
+
+    def _grow(self):
+        capacity = min(max(self.capacity * 2, INITIAL_CAPACITY), self.max_entries)
+        added = capacity - self.capacity
+        self.projected = np.concatenate([self.projected, np.zeros((added, self.projected_dimensions), dtype=np.float32)])
+        self.vectors = np.concatenate([self.vectors, np.zeros((added, self.dimensions), dtype=np.float16)])
+        self.expires_at = np.concatenate([self.expires_at, np.zeros(added)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(added)])
+        self.occupied = np.concatenate([self.occupied, np.zeros(added, dtype=bool)])
+        self.entries.extend([None] * added)
+        self.capacity = capacity
+
+    def _nearest(self, query_vector):
+        if self.dimensions is None or len(query_vector) != self.dimensions or not self.used:
+            return None
+
+        used = self.used
+        live = self.occupied[:used] & (self.expires_at[:used] > time.time())
+        if not live.any():
+            return None
+
+        #Shortlist on the projected vectors, then confirm with the exact cosine similarity
+        vector = self._normalize(query_vector)
+        scores = self.projected[:used] @ self._normalize(vector @ self.projection)
+        scores[~live] = -np.inf
+        count = min(self.shortlist, int(live.sum()))
+        candidates = np.argpartition(-scores, count - 1)[:count]
+        candidates = candidates[np.isfinite(scores[candidates])]
+
+        exact = self.vectors[candidates].astype(np.float32) @ vector
+        best = int(np.argmax(exact))
+        if exact[best] < self.threshold:
+            return None
+        return int(candidates[best])
+
+    def _apply_source_updates(self):
+        #Poll the ingest side's update log at most every invalidation_poll seconds
+        now = time.time()
+        if now < self.next_invalidation_poll:
+            return
+        self.next_invalidation_poll = now + self.invalidation_poll
+
+        rows = self.db.execute(
+            "SELECT source, updated_at FROM source_updates WHERE updated_at > ?",
+            (self.last_invalidation_check,),
+        ).fetchall()
+        for source, updated_at in rows:
+            self.last_invalidation_check = max(self.last_invalidation_check, updated_at)
+            #Excel sheets are indexed as "<file> - <sheet>", so an updated file also covers its sheets
+            for cited in list(self.slots_by_source):
+                if cited == source or cited.startswith(source + " - "):
+                    for slot in list(self.slots_by_source.get(cited, ())):
+                        self._release(slot)
+
+    def _release(self, slot):
+        if self.entries[slot] is not None:
+            for source in self.entries[slot][2]:
+                slots = self.slots_by_source.get(source)
+                if slots is not None:
+                    slots.discard(slot)
+                    if not slots:
+                        del self.slots_by_source[source]
+        self.entries[slot] = None
+        self.occupied[slot] = False
+        self.expires_at[slot] = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,103 @@
+import json
+import time
+
+from opensearchpy.exceptions import TransportError
+
+
+#Buffered _bulk indexing for the document ingest script
+#Documents are queued with a label (e.g. "Page: 3") and sent in batches bounded by document count and request size
+#Every document's outcome is reported back through the report callback with its label
+#Items rejected with 429 (AOSS throttling) are retried with exponential backoff, the rest of the batch is not resent
+#This is the retry policy of opensearchpy.helpers.streaming_bulk, done on client.bulk directly because
+#streaming_bulk yields retried items out of order, which would lose the page/slide label of each result
+
+
+class BulkIndexer:
+
+    def __init__(self, client, index, report=None, max_docs=200, max_bytes=10 * 1024 * 1024,
+                 max_retries=5, initial_backoff=2, max_backoff=60):
+        self.client = client
+        self.index = index
+        self.report = report
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.buffer = []  #(action, document, label)
+        self.buffer_bytes = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        #Whatever was buffered before an error still gets indexed
+        self.flush()
+
+    def add(self, document, label, action="index", doc_id=None, index=None):
+        meta = {"_index": index or self.index}
+        if doc_id is not None:
+            meta["_id"] = doc_id
+        size = len(json.dumps(document)) if document is not None else 0
+
+        if self.buffer and (len(self.buffer) >= self.max_docs or self.buffer_bytes + size > self.max_bytes):
+            self.flush()
+
+        self.buffer.append(({action: meta}, document, label))
+        self.buffer_bytes += size
+
+    def flush(self):
+        batch = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+
+        pending = list(range(len(batch)))
+        attempt = 0
+        backoff = self.initial_backoff
+        while pending:
+            body = []
+            for position in pending:
+                action, document, label = batch[position]
+                body.append(action)
+                if document is not None:  #delete actions have no document line
+                    body.append(document)
+
+            try:
+                response = self.client.bulk(body=body)
+            except TransportError as e:
+                if e.status_code == 429 and attempt < self.max_retries:
+                    attempt, backoff = self._wait(attempt, backoff)
+                    continue
+                for position in pending:
+                    self._report(batch[position][2], False, str(e))
+                return
+
+            retry = []
+            for position, item in zip(pending, response["items"]):
+                result = next(iter(item.values()))
+                status = result.get("status", 500)
+                if 200 <= status < 300 or (status == 404 and "delete" in item):  #already gone counts as deleted
+                    self._report(batch[position][2], True, result)
+                elif status == 429 and attempt < self.max_retries:
+                    retry.append(position)
+                else:
+                    self._report(batch[position][2], False, result.get("error", status))
+
+            pending = retry
+            if pending:
+                attempt, backoff = self._wait(attempt, backoff)
+
+    def _wait(self, attempt, backoff):
+        time.sleep(backoff)
+        return attempt + 1, min(backoff * 2, self.max_backoff)
+
+    def _report(self, label, ok, info):
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        if self.report is not None:
+            self.report(label, ok, info)
@@ -0,0 +1,188 @@
+import argparse
+import multiprocessing
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from . import ingest
+from .answer_cache import mark_sources_updated
+
+
+#Bulk ingest of whole directories and archives
+#Files are dispatched by ingest.extension_to_type and parsed in a process pool (parsing is CPU bound, embedding and
+#indexing are I/O bound); parsed files are fed, as they finish, into one shared ingest.index_files run
+#
+#   python -m compliance_qa.bulk_ingest ./regulations ./validation-rules.zip --parse-workers 8
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def extract_archive(path, directory):
+    #zipfile strips absolute paths and "..", the tar "data" filter refuses links and paths leaving the directory
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            archive.extractall(directory)
+    else:
+        with tarfile.open(path) as archive:
+            archive.extractall(directory, filter="data")
+
+
+def walk_files(path, name, extract_dir):
+    #Yields (file_path, original_file_name) for every file under path, archives included
+    #original_file_name is the path relative to what was given, so files with the same name in two folders stay apart
+    if os.path.isdir(path):
+        for directory, subdirectories, file_names in os.walk(path):
+            subdirectories.sort()
+            for file_name in sorted(file_names):
+                file_path = os.path.join(directory, file_name)
+                yield from walk_files(file_path, os.path.join(name, os.path.relpath(file_path, path)), extract_dir)
+    elif is_archive(path):
+        directory = tempfile.mkdtemp(dir=extract_dir)
+        extract_archive(path, directory)
+        yield from walk_files(directory, name, extract_dir)
+    else:
+        yield path, name
+
+
+def file_type_of(file_name):
+    _, file_extension = os.path.splitext(file_name)
+    return ingest.extension_to_type.get(file_extension.lower(), 'Unknown')
+
+
+def parse_file(file_path, original_file_name, file_type):
+    #Runs in a parse worker, the chunks are sent back to the indexing process whole
+    chunks = ingest.iter_file_chunks(file_path, original_file_name, file_type)
+    return list(chunks) if chunks is not None else None
+
+
+def share_ocr_workers(ocr_workers):
+    #Parse worker initializer - the parse workers split the cores between their OCR pools instead of each taking all
+    ingest.OCR_WORKERS = ocr_workers
+
+
+def parsed_files(files, parse_workers, summary, progress):
+    #Yields (original_file_name, chunks) as files finish parsing; at most 2 files per worker are parsed or waiting
+    #Failed and unsupported files are recorded in summary instead
+    def parsed(original_file_name, chunks, error):
+        if error is not None:
+            progress(f"Error parsing {original_file_name} - {str(error)}")
+            summary["failed_files"].append((original_file_name, str(error)))
+        elif chunks is None:
+            summary["skipped_files"].append(original_file_name)
+        else:
+            return original_file_name, chunks
+        return None
+
+    if parse_workers <= 0:
+        #Parsing on a thread of this process, e.g. inside an ingest job worker, which can't start processes
+        def parse_all():
+            for file_path, original_file_name, file_type in files:
+                try:
+                    yield parsed(original_file_name, parse_file(file_path, original_file_name, file_type), None)
+                except Exception as e:
+                    yield parsed(original_file_name, None, e)
+
+        for result in ingest.iter_in_background(parse_all(), maxsize=2):
+            if result is not None:
+                yield result
+        return
+
+    #Spawned, not forked, so the workers don't inherit this process's embedding threads
+    ocr_workers = max(ingest.OCR_WORKERS // parse_workers, 1)
+    with ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=share_ocr_workers, initargs=(ocr_workers,)) as executor:
+        files = iter(files)
+        in_flight = {}
+        while True:
+            while len(in_flight) < parse_workers * 2:
+                next_file = next(files, None)
+                if next_file is None:
+                    break
+                file_path, original_file_name, file_type = next_file
+                in_flight[executor.submit(parse_file, file_path, original_file_name, file_type)] = original_file_name
+            if not in_flight:
+                return
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                original_file_name = in_flight.pop(future)
+                try:
+                    result = parsed(original_file_name, future.result(), None)
+                except Exception as e:
+                    result = parsed(original_file_name, None, e)
+                if result is not None:
+                    yield result
+
+
+def ingest_paths(paths, parse_workers=os.cpu_count() or 1, progress=print, names=None):
+    #Ingests every supported file under paths (files, directories, archives) and returns the summary
+    #names optionally maps a path to the name it is indexed under, e.g. an upload's original file name
+    summary = {"failed_files": [], "skipped_files": [], "indexed_files": []}
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(prefix="bulk-ingest-") as extract_dir:
+        def files():
+            for path in paths:
+                name = (names or {}).get(path) or os.path.basename(os.path.normpath(path))
+                for file_path, original_file_name in walk_files(path, name, extract_dir):
+                    file_type = file_type_of(file_path)
+                    if file_type == 'Unknown':
+                        summary["skipped_files"].append(original_file_name)
+                        continue
+                    yield file_path, original_file_name, file_type
+
+        def indexed(parsed):
+            for original_file_name, chunks in parsed:
+                summary["indexed_files"].append(original_file_name)
+                progress(f"Parsed {original_file_name}: {len(chunks)} chunks")
+                yield original_file_name, chunks
+
+        counts = ingest.index_files(indexed(parsed_files(files(), parse_workers, summary, progress)), progress)
+
+    summary.update(counts)
+    summary["seconds"] = time.perf_counter() - started
+
+    # Cached Q&A answers that cited these files may now be out of date
+    sources = summary["indexed_files"] + [os.path.basename(name) for name in summary["indexed_files"]]
+    if sources:
+        mark_sources_updated(os.environ.get('ANSWER_CACHE_PATH', 'answer_cache.sqlite3'), sources)
+    return summary
+
+
+def format_summary(summary):
+    seconds = max(summary["seconds"], 1e-9)
+    lines = [
+        f"Files: {len(summary['indexed_files'])} indexed, {len(summary['skipped_files'])} skipped (unsupported type), "
+        f"{len(summary['failed_files'])} failed to parse",
+        f"Pages: {summary.get('pages', 0)} in {seconds:.1f}s ({summary.get('pages', 0) / seconds:.1f} pages/sec)",
+        f"Chunks: {summary.get('chunks', 0)} read, {summary.get('unchanged', 0)} unchanged, "
+        f"{summary.get('embedded', 0)} embedded ({summary.get('embedded', 0) / seconds:.1f} embeddings/sec), "
+        f"{summary.get('indexed', 0)} indexed, {summary.get('deleted', 0)} removed",
+        f"Failures: {summary.get('embedding_failures', 0)} embedding, {summary.get('index_failures', 0)} indexing",
+    ]
+    for original_file_name, error in summary["failed_files"]:
+        lines.append(f"  {original_file_name}: {error}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest every supported file in directories and archives")
+    parser.add_argument("paths", nargs="+", help="files, directories, .zip or .tar(.gz) archives")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1, help="parsing processes, 0 to parse in this process")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+
+    summary = ingest_paths(args.paths, args.parse_workers, progress=(lambda message: None) if args.quiet else print)
+    print(format_summary(summary))
+
+
+if __name__ == "__main__":
+    main()
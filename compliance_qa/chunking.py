@@ -0,0 +1,79 @@
+import re
+
+
+#Sliding-window chunker shared by every ingest format
+#Text comes in as a stream of pieces (pages, slides, paragraphs, spreadsheet blocks) and goes out as windows of at
+#most CHUNK_TOKENS tokens; each window starts CHUNK_OVERLAP_TOKENS before the previous one ended, so a passage cut
+#by a boundary is whole in one of the two chunks. A window ends after the last full sentence in its second half
+#when there is one. Tokens are estimated like fusion.estimate_tokens does for context packing, 4 characters per token
+#Only the current window is held in memory, however long the document
+
+
+CHUNK_TOKENS = 1000 #about the 4000 characters of the text splitter PDFs used before
+CHUNK_OVERLAP_TOKENS = 100
+
+WORD = re.compile(r"\S+\s*")
+SENTENCE_END = re.compile(r"[.!?:;][\"')\]]*\s+$")
+
+
+def word_tokens(word):
+    #Per word, so no +1 - a window's tokens add up to about its estimate_tokens
+    return len(word) / 4
+
+
+def split_long_word(word, max_tokens):
+    #A "word" longer than a whole window (a URL, a run of table characters) is cut into window-sized parts
+    size = max(int(max_tokens * 4), 1)
+    for start in range(0, len(word), size):
+        yield word[start:start + size]
+
+
+def sliding_windows(texts, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    #Yields the chunk texts of texts, an iterable of strings that may be a generator reading a file
+    #Whitespace inside a window is kept as it was, so table rows and paragraphs stay on their own lines
+    window = []  #(word with its trailing whitespace, tokens)
+    tokens = 0
+
+    def cut():
+        nonlocal window, tokens
+        end = len(window)
+        for candidate in range(len(window), len(window) // 2, -1):
+            if SENTENCE_END.search(window[candidate - 1][0]):
+                end = candidate
+                break
+        chunk, rest = window[:end], window[end:]
+
+        #The overlap never covers the whole chunk, so every cut moves the window forward
+        overlap, overlap_used = [], 0
+        for word, cost in reversed(chunk[1:]):
+            if overlap_used + cost > overlap_tokens:
+                break
+            overlap.append((word, cost))
+            overlap_used += cost
+        overlap.reverse()
+        #Starting at a sentence when the overlap has one
+        for start in range(1, len(overlap)):
+            if SENTENCE_END.search(overlap[start - 1][0]):
+                overlap = overlap[start:]
+                break
+        window = overlap + rest
+        tokens = sum(cost for _, cost in window)
+        return "".join(word for word, _ in chunk).strip()
+
+    for text in texts:
+        for match in WORD.finditer(text):
+            word = match.group(0)
+            parts = [word] if word_tokens(word) <= max_tokens else split_long_word(word, max_tokens)
+            for part in parts:
+                cost = word_tokens(part)
+                while window and tokens + cost > max_tokens:
+                    yield cut()
+                window.append((part, cost))
+                tokens += cost
+        #Pieces are separate passages, the next one must not run on from the last word of this one
+        if window and not window[-1][0][-1].isspace():
+            window[-1] = (window[-1][0] + "\n", window[-1][1])
+
+    chunk = "".join(word for word, _ in window).strip()
+    if chunk:
+        yield chunk
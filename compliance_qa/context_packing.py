@@ -0,0 +1,88 @@
+import re
+
+from .fusion import estimate_tokens, format_passage
+
+
+#Token-budgeted context packing for invoke_llm
+#Passages are taken in fused rank order; a passage longer than max_passage_tokens (or than what is left of the
+#budget) is trimmed to its window of sentences that best matches the question, and passages that mostly repeat
+#text already packed (overlapping PDF splits, the same clause in two documents) are skipped
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\n+")
+WORD = re.compile(r"\w+")
+
+
+def sentences(text):
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+def shingles(text, size=5):
+    words = WORD.findall(text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def best_span(text, question_terms, max_tokens):
+    #Contiguous run of sentences under max_tokens with the most question terms in it, earliest run on ties
+    parts = sentences(text)
+    sizes = [estimate_tokens(part) for part in parts]
+    hits = [sum(1 for word in WORD.findall(part.lower()) if word in question_terms) for part in parts]
+
+    best, best_score = (0, 0), -1
+    end = 0
+    tokens = 0
+    score = 0
+    for start in range(len(parts)):
+        if end < start:
+            end, tokens, score = start, 0, 0
+        while end < len(parts) and tokens + sizes[end] <= max_tokens:
+            tokens += sizes[end]
+            score += hits[end]
+            end += 1
+        if end > start and score > best_score:
+            best, best_score = (start, end), score
+        if end > start:
+            tokens -= sizes[start]
+            score -= hits[start]
+
+    start, end = best
+    if end == start:
+        #Not even one sentence fits, fall back to a hard cut at ~4 characters per token
+        return text[:max_tokens * 4]
+    return " ".join(parts[start:end])
+
+
+def pack_context(hits, question, token_budget, max_passage_tokens, max_overlap=0.6, min_passage_tokens=40):
+    #Returns (context, packed hits, packed token count)
+    question_terms = set(WORD.findall(question.lower()))
+    packed_shingles = set()
+    passages = []
+    used_hits = []
+    used = 0
+
+    for hit in hits:
+        remaining = token_budget - used
+        if remaining < min_passage_tokens:
+            break
+
+        overhead = estimate_tokens(format_passage(dict(hit, content="")))
+        limit = min(max_passage_tokens, remaining) - overhead
+        if limit <= 0:
+            break
+        content = hit["content"]
+        if estimate_tokens(content) > limit:
+            content = best_span(content, question_terms, limit)
+        if not content.strip():
+            continue
+
+        passage_shingles = shingles(content)
+        if len(passage_shingles & packed_shingles) > max_overlap * len(passage_shingles):
+            continue
+
+        passage = format_passage(dict(hit, content=content))
+        passages.append(passage)
+        used_hits.append(hit)
+        packed_shingles |= passage_shingles
+        used += estimate_tokens(passage)
+
+    return "".join(passages), used_hits, used
@@ -0,0 +1,123 @@
+import shutil
+import subprocess
+import zipfile
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+
+#Text extraction for the HTML, Word and plain text ingest paths
+#Each reader yields a document's paragraphs in order while reading it, for chunking.sliding_windows; only the
+#standard library is needed, except legacy .doc files which go through the antiword command
+
+
+READ_SIZE = 64 * 1024
+
+HTML_SKIPPED_TAGS = {'script', 'style', 'noscript', 'template', 'svg'}
+HTML_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'caption', 'dd', 'div', 'dl', 'dt', 'figcaption', 'footer',
+    'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section',
+    'table', 'td', 'th', 'title', 'tr', 'ul',
+}
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def iter_paragraphs(lines):
+    #Groups lines into blank-line separated paragraphs
+    paragraph = []
+    for line in lines:
+        if line.strip():
+            paragraph.append(line.strip())
+        elif paragraph:
+            yield "\n".join(paragraph)
+            paragraph = []
+    if paragraph:
+        yield "\n".join(paragraph)
+
+
+def iter_text_file(file_path):
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        yield from iter_paragraphs(f)
+
+
+class HTMLText(HTMLParser):
+    #Visible text of a page, one string per block element, collected as the page is fed in
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skipping = 0
+        self.current = []
+        self.blocks = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self.end_block()
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in HTML_BLOCK_TAGS:
+            self.end_block()
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.current.append(data)
+
+    def end_block(self):
+        text = " ".join("".join(self.current).split())
+        self.current = []
+        if text:
+            self.blocks.append(text)
+
+
+def iter_html_text(file_path):
+    parser = HTMLText()
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            yield from parser.blocks
+            parser.blocks = []
+    parser.close()
+    parser.end_block()
+    yield from parser.blocks
+
+
+def iter_docx_text(file_path):
+    #word/document.xml is parsed incrementally and each paragraph dropped once read (table cells are paragraphs too)
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as document:
+        runs = []
+        for _, element in ElementTree.iterparse(document, events=('end',)):
+            if element.tag == WORD_NAMESPACE + 't':
+                runs.append(element.text or "")
+            elif element.tag == WORD_NAMESPACE + 'tab':
+                runs.append("\t")
+            elif element.tag in (WORD_NAMESPACE + 'br', WORD_NAMESPACE + 'cr'):
+                runs.append("\n")
+            elif element.tag == WORD_NAMESPACE + 'p':
+                text = "".join(runs).strip()
+                runs = []
+                element.clear()
+                if text:
+                    yield text
+
+
+def iter_doc_text(file_path):
+    #Legacy binary .doc - antiword writes the text to stdout, which is read as it comes
+    if shutil.which('antiword') is None:
+        raise ValueError("Reading .doc files needs antiword installed, or save the document as .docx")
+    with subprocess.Popen(['antiword', file_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace") as process:
+        yield from iter_paragraphs(process.stdout)
+        error = process.stderr.read()
+    if process.returncode:
+        raise ValueError(f"antiword could not read the document: {error.strip()}")
+
+
+def iter_word_text(file_path):
+    if zipfile.is_zipfile(file_path):
+        return iter_docx_text(file_path)
+    return iter_doc_text(file_path)
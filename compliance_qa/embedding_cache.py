@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+#Embedding cache shared by the Q&A and document ingest scripts
+#Keys are a hash of the embedding model id and the exact input text, so switching models never returns stale vectors
+#Tier 1 is an in-process LRU, tier 2 is a SQLite file holding the vectors as packed float32 blobs
+
+
+def cache_key(model_id, text):
+    return hashlib.sha256((model_id + "\x00" + text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+
+    def __init__(self, path="embedding_cache.sqlite3", memory_entries=10000, disk_entries=500000):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        #One connection shared by the retrieval/ingest worker threads, guarded by self.lock
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model_id TEXT NOT NULL, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.db.commit()
+        self.disk_count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get(self, model_id, text):
+        key = cache_key(model_id, text)
+
+        with self.lock:
+            embedding = self.memory.get(key)
+            if embedding is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return list(embedding)
+
+            row = self.db.execute("SELECT embedding FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+
+            embedding = array("f")
+            embedding.frombytes(row[0])
+            self._remember(key, embedding)
+            self.hits += 1
+            self.disk_hits += 1
+            return list(embedding)
+
+    def put(self, model_id, text, embedding):
+        key = cache_key(model_id, text)
+        packed = array("f", embedding)
+
+        with self.lock:
+            self._remember(key, packed)
+
+            inserted = self.db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model_id, embedding, last_used) VALUES (?, ?, ?, ?)",
+                (key, model_id, packed.tobytes(), time.time()),
+            ).rowcount
+            self.disk_count += inserted
+            if self.disk_count > self.disk_entries:
+                self._evict_disk()
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "disk_entries": self.disk_count,
+            }
+
+    def _remember(self, key, embedding):
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        #Drop the least recently used tenth in one statement instead of one row per insert
+        self.disk_count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self.disk_count - self.disk_entries + max(self.disk_entries // 10, 1)
+        if excess > 0:
+            self.db.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.disk_count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
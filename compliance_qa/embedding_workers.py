@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+
+#Parallel, rate limited embedding stage for the document ingest script
+#A bounded worker pool embeds chunks concurrently while an adaptive token bucket keeps the request rate
+#under the Bedrock TPS quota: the rate halves on every ThrottlingException and creeps back up on success
+#Results always come back in input order, so pages are indexed in the order they were read
+
+
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, max_rate, min_rate=0.5, increase=0.1):
+        self.max_rate = max_rate  #requests per second allowed by the quota
+        self.min_rate = min_rate
+        self.increase = increase  #requests per second added back after each successful call
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                #Allow a burst of up to one second of requests, but always at least one token
+                self.tokens = min(max(self.rate, 1), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+
+
+def is_throttling(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def call_with_rate_limit(limiter, fn, max_retries=8, **kwargs):
+    #Calls a Bedrock API through the limiter, backing off and retrying while the call is throttled
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = fn(**kwargs)
+        except Exception as e:
+            if not is_throttling(e) or attempt == max_retries:
+                raise
+            limiter.on_throttle()
+            continue
+        limiter.on_success()
+        return response
+
+
+def embed_in_order(items, text_of, embed, workers=16, window=None):
+    #Embeds every item on a pool of workers and yields (item, embedding, error) in input order
+    #At most `window` items are in flight, so a slow or huge input is never fully buffered
+    window = window or workers * 4
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            in_flight.append((item, executor.submit(embed, text_of(item))))
+            if len(in_flight) >= window:
+                yield result_of(*in_flight.popleft())
+        while in_flight:
+            yield result_of(*in_flight.popleft())
+
+
+def result_of(item, future):
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, e
@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+#Tabular chunker for the document ingest script
+#Sheets are read in batches of rows (openpyxl read-only mode for .xlsx, so the workbook never has to fit in memory),
+#row strings are built with vectorized pandas string operations, and block boundaries come from a cumulative sum
+#of row lengths instead of growing a string row by row
+#Blocks are the same as the original row-by-row loop: the header followed by as many rows as fit under max_length,
+#where a block after the first always keeps the row that overflowed the previous one
+
+
+def column_names(values):
+    #Same names pandas.read_excel gives the header row: "Unnamed: n" for empty cells, ".1", ".2" for duplicates
+    names = []
+    seen = {}
+    for position, value in enumerate(values):
+        name = f"Unnamed: {position}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def row_strings(df):
+    #Equivalent of df.astype(str).apply(lambda x: ' '.join(x.dropna().values), axis=1), one column at a time:
+    #every present value gets a trailing space, missing values become "", and the last space is cut off
+    if df.shape[1] == 0:
+        return np.full(len(df), "", dtype=object)
+    columns = []
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        columns.append((column.astype(str).astype(object) + " ").mask(column.isna(), ""))
+    rows = columns[0].str.cat(columns[1:]) if len(columns) > 1 else columns[0]
+    return rows.str.slice(0, -1).to_numpy(dtype=object)
+
+
+def read_sheet_batches(file_name, batch_rows=10000):
+    #Yields (sheet_name, header, row_batches) where row_batches is an iterator of DataFrames
+    if os.path.splitext(file_name)[1].lower() != ".xlsx":
+        #openpyxl can't read the legacy .xls format, those sheets are loaded whole
+        xls = pd.ExcelFile(file_name)
+        for sheet_name in xls.sheet_names:
+            df = pd.read_excel(xls, sheet_name=sheet_name)
+            yield sheet_name, ' '.join(df.columns.astype(str)), iter([df])
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            rows = (row for row in worksheet.iter_rows(values_only=True) if any(value is not None for value in row))
+            header_row = next(rows, None)
+            if header_row is None:
+                continue
+            columns = column_names(header_row)
+            yield worksheet.title, ' '.join(columns), batches(rows, len(columns), batch_rows)
+    finally:
+        workbook.close()
+
+
+def batches(rows, width, batch_rows):
+    batch = []
+    for row in rows:
+        batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+        if len(batch) >= batch_rows:
+            yield pd.DataFrame.from_records(batch).infer_objects()
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch).infer_objects()
+
+
+def iter_blocks(header, row_batches, max_length):
+    #Yields header-prefixed blocks, at most max_length characters unless a single row is longer on its own
+    header_length = len(header)
+    open_rows = np.array([], dtype=object)  #rows of the block that is still being filled
+    first = True  #the first block of a sheet starts from the header alone, later ones from an overflowing row
+
+    for df in row_batches:
+        rows = np.concatenate([open_rows, row_strings(df)])
+        ends = np.concatenate([[0], np.cumsum(pd.Series(rows, dtype=object).str.len().to_numpy() + 1)])  #+1 for the space
+
+        start = 0
+        while True:
+            #rows[start:end] fit when header_length + ends[end] - ends[start] < max_length
+            end = int(np.searchsorted(ends, ends[start] + max_length - header_length, side="left")) - 1
+            end = max(end, start if first else start + 1)
+            if end >= len(rows):
+                break
+            yield join_block(header, rows[start:end])
+            start = end
+            first = False
+        open_rows = rows[start:]
+
+    yield join_block(header, open_rows)
+
+
+def join_block(header, rows):
+    if len(rows) == 0:
+        return header
+    return header + " " + " ".join(rows)
@@ -0,0 +1,51 @@
+import hashlib
+
+
+#Client-side hybrid fusion for the Q&A script
+#The semantic, keyword and keyword-semantic result lists are turned into structured hits, deduplicated by document
+#and merged with Reciprocal Rank Fusion; context_packing.py then writes the best of them out under a token budget
+
+
+def hits_from_response(response):
+    #kNN queries return "fields" (each value a list), keyword queries return "_source"
+    hits = []
+    for i in response["hits"]["hits"]:
+        if "fields" in i:
+            fields = {key: value[0] if isinstance(value, list) and value else value for key, value in i["fields"].items()}
+        else:
+            fields = i.get("_source", {})
+        content = str(fields.get("content", ""))
+        hits.append({
+            "id": i.get("_id") or hashlib.sha1(f"{fields.get('source')}\x00{fields.get('page')}\x00{content}".encode("utf-8")).hexdigest(),
+            "score": i.get("_score"),
+            "content": content,
+            "source": fields.get("source"),
+            "page": fields.get("page"),
+        })
+    return hits
+
+
+def reciprocal_rank_fusion(ranked_lists, weights=None, k=60):
+    #score(d) = sum over lists of weight / (k + rank of d in that list), each document counted once per list
+    weights = weights or [1.0] * len(ranked_lists)
+    fused = {}
+    for hits, weight in zip(ranked_lists, weights):
+        seen = set()
+        for rank, hit in enumerate(hits, start=1):
+            if hit["id"] in seen:
+                continue
+            seen.add(hit["id"])
+            entry = fused.setdefault(hit["id"], dict(hit, rrf_score=0.0))
+            if not entry["content"]:
+                entry["content"] = hit["content"]  #kNN hits from a split index have no text, a keyword hit does
+            entry["rrf_score"] += weight / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)
+
+
+def estimate_tokens(text):
+    #Rough Claude token count, about 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def format_passage(hit):
+    return "Page Content: " + hit["content"] + "\n" + "Source: " + str(hit["source"]) + "\n" + "Page Number: " + str(hit["page"]) + "\n\n"
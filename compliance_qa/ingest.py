@@ -0,0 +1,454 @@
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import Counter, deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import resources
+from .bulk_indexer import BulkIndexer
+from .chunking import CHUNK_TOKENS, sliding_windows
+from .document_text import iter_html_text, iter_text_file, iter_word_text
+from .embedding_workers import AdaptiveRateLimiter, call_with_rate_limit, embed_in_order
+from .ingest_manifest import IngestManifest, content_hash, make_doc_id
+from .pdf_ocr import needs_ocr, ocr_available, ocr_page
+from .resources import CONTENT_INDEX_NAME, INDEX_NAME, resource
+from .retrieval_backends import LocalVectorIndex
+from .vector_storage import embedding_cache_id, embedding_model_id, embedding_request, layout_id, stored_vector
+
+
+#Document ingest - parse a file into chunks, embed them and index them in AOSS (and the optional local index)
+#process_files is the entry point; progress messages go to the progress callback, st.write in
+#document-ingest-cleaned.py, the Streamlit front-end
+#Every format is cut into chunks by chunking.sliding_windows, so chunk sizes are the same whatever the file type
+#PDF, PowerPoint and Excel libraries are imported by the function handling that format
+
+
+#Embedding stage - chunks are embedded on EMBEDDING_WORKERS threads, throttled to the Titan TPS quota
+EMBEDDING_WORKERS = 16
+EMBEDDING_MAX_TPS = 30
+
+#Parsed chunks waiting to be embedded - bounds how far parsing can run ahead of embedding/indexing
+PIPELINE_QUEUE_SIZE = 64
+
+#Scanned PDF pages are OCR'd on this many cores, while the pages after them are read and embedded
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+
+#Valid File Types
+extension_to_type = {
+    '.pdf': 'PDF',
+    '.html': 'HTML',
+    '.htm': 'HTML',
+    '.doc': 'Word',
+    '.docx': 'Word',
+    '.ppt': 'PowerPoint',
+    '.pptx': 'PowerPoint',
+    '.xls': 'Excel',
+    '.xlsx': 'Excel',
+    '.txt': 'Text',
+    '.zip': 'Archive',
+    '.tar': 'Archive',
+    '.tgz': 'Archive',
+    # Add more mappings as necessary
+}
+
+EMBEDDING_MODEL_ID = embedding_model_id() #Titan v1, or v2 when vector_storage.EMBEDDING_DIMENSIONS is reduced
+
+#Pages/slides/blocks are sent to the index in _bulk requests of at most this many documents or bytes
+BULK_MAX_DOCS = 200
+BULK_MAX_BYTES = 10 * 1024 * 1024
+
+
+@resource
+def embedding_limiter():
+    #One limiter per process, so concurrent uploads share the Titan quota
+    return AdaptiveRateLimiter(EMBEDDING_MAX_TPS)
+
+
+@resource
+def ocr_pool():
+    #Spawned like the other pools, and kept for the life of the process so its workers are started once
+    #A daemonic process (an ingest job worker) can't have children; rendering and OCR happen in the pdftoppm and
+    #tesseract commands anyway, so there threads keep as many cores busy
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+    return ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+@resource
+def manifest():
+    return IngestManifest(os.environ.get('INGEST_MANIFEST_PATH', 'ingest_manifest.sqlite3'))
+
+
+@resource
+def local_index():
+    #Mirror of the AOSS index for RETRIEVAL_BACKEND=local in the Q&A module, only kept when LOCAL_INDEX_PATH is set
+    #Chunks the manifest already has are skipped, so clear the manifest to fill a new local index from existing files
+    if not os.environ.get('LOCAL_INDEX_PATH'):
+        return None
+    return LocalVectorIndex(os.environ['LOCAL_INDEX_PATH'])
+
+
+def get_embeddings(bedrock, text):
+    modelId = EMBEDDING_MODEL_ID
+
+    embedding = resources.embedding_cache().get(embedding_cache_id(), text)
+    if embedding is not None:
+        return embedding
+
+    body_text = json.dumps(embedding_request(text))
+    accept = 'application/json'
+    contentType='application/json'
+
+    response = call_with_rate_limit(embedding_limiter(), bedrock.invoke_model, body=body_text, modelId=modelId, accept=accept, contentType=contentType)
+    response_body = json.loads(response.get('body').read())
+    embedding = response_body.get('embedding')
+
+    resources.embedding_cache().put(embedding_cache_id(), text, embedding)
+    return embedding
+
+def indexed_page(page_number):
+    #1-based page/slide number, or the sheet name of an Excel block
+    try:
+        return int(page_number)+1
+    except:
+        return page_number
+
+
+def build_index_document(vectors, content, source, page_number):
+    #Vector index document - vectors stored as vector_storage says, without the content when it has its own index
+
+    indexDocument={
+        'vectors': stored_vector(vectors),
+        'source': source,
+        'page': indexed_page(page_number)
+        }
+    if not CONTENT_INDEX_NAME:
+        indexDocument['content'] = content
+
+    return indexDocument
+
+
+def build_content_document(content, source, page_number):
+    #Content index document, same id as the chunk's vector document
+    return {'content': content, 'source': source, 'page': indexed_page(page_number)}
+
+
+def report_indexing(label, ok, info, progress=print):
+    #Per-document outcome of a bulk flush, written to the progress output (st.write in the Streamlit page)
+    if ok:
+        progress(f"{label} Done")
+    else:
+        progress(f"Error indexing {label} - {str(info)}")
+
+
+def embed_chunks(chunks):
+    #chunks are (content, ...) tuples, yielded back in the same order as (chunk, embeddings, error)
+    return embed_in_order(chunks, lambda chunk: chunk[0], lambda text: get_embeddings(resources.bedrock(), text), workers=EMBEDDING_WORKERS)
+
+
+def index_chunks(original_file_name, chunks, progress=print):
+    #Shared embed + index stage for every file type
+    #chunks are (content, source, page_number, chunk_index, label) tuples
+    return index_files([(original_file_name, chunks)], progress)
+
+
+def index_files(files, progress=print):
+    #files are (original_file_name, chunks) pairs; every file goes through the same embedding pool and bulk indexer,
+    #so a run of small files still makes full _bulk requests
+    #Only chunks whose content changed since the last ingest of their file are embedded and upserted,
+    #and chunks that are no longer in a file are deleted from the index
+    #Returns counts of what was done, for bulk ingest's summary
+    manifest_store, mirror, term_stats = manifest(), local_index(), resources.term_stats()
+    writes = 2 if CONTENT_INDEX_NAME else 1  #a split layout writes (and deletes) a vector and a content document
+    pending = {}  #doc_id -> [file, content hash, writes left], recorded in the manifest once the index confirms them
+    stale = []  #doc ids of chunks that are no longer in their file
+    deleting = set()
+    layout = layout_id()
+    pages = set()
+    counts = Counter()
+
+    def changed_chunks():
+        for original_file_name, chunks in files:
+            previous = manifest_store.chunks_for(original_file_name)
+            seen = set()
+            for content, source, page_number, chunk_index, label in chunks:
+                #The file's own name, not the source - two notes.txt in different folders both cite "notes.txt"
+                doc_id = make_doc_id(original_file_name, page_number, chunk_index)
+                seen.add(doc_id)
+                pages.add((source, page_number))
+                counts["chunks"] += 1
+                chunk_hash = content_hash(layout, content)
+                if previous.get(doc_id) == chunk_hash:
+                    counts["unchanged"] += 1
+                    continue
+                pending[doc_id] = [original_file_name, chunk_hash, writes]
+                yield content, source, page_number, label, doc_id
+            #Only once the whole file was read, a file that failed to parse half way keeps its other chunks
+            stale.extend(previous.keys() - seen)
+            counts["files"] += 1
+
+    def report(label, ok, info):
+        report_indexing(label, ok, info, progress)
+        if not ok:
+            counts["index_failures"] += 1
+            return
+        doc_id = info.get("_id")
+        if doc_id in pending:
+            pending[doc_id][2] -= 1
+            if pending[doc_id][2] == 0:
+                original_file_name, chunk_hash, _ = pending.pop(doc_id)
+                manifest_store.record(doc_id, original_file_name, chunk_hash)
+                counts["indexed"] += 1
+        elif doc_id in deleting:
+            deleting.discard(doc_id)
+            manifest_store.remove(doc_id)
+            counts["deleted"] += 1
+
+    with BulkIndexer(resources.opensearch(), INDEX_NAME, report, max_docs=BULK_MAX_DOCS, max_bytes=BULK_MAX_BYTES) as indexer:
+        for (content, source, page_number, label, doc_id), embeddings, error in embed_chunks(changed_chunks()):
+            if error is not None:
+                progress(f"Error embedding {label} - {str(error)}")
+                counts["embedding_failures"] += 1
+                continue
+
+            counts["embedded"] += 1
+            document = build_index_document(embeddings, content, source, page_number)
+            indexer.add(document, label, doc_id=doc_id)
+            if CONTENT_INDEX_NAME:
+                indexer.add(build_content_document(content, source, page_number), label, doc_id=doc_id, index=CONTENT_INDEX_NAME)
+            if mirror is not None:
+                mirror.add(doc_id, document['vectors'], content, document['source'], document['page'])
+            term_stats.add_document(doc_id, content)
+
+        deleting.update(stale)
+        for doc_id in stale:
+            indexer.add(None, f"Removed chunk {doc_id}", action="delete", doc_id=doc_id)
+            if CONTENT_INDEX_NAME:
+                indexer.add(None, f"Removed chunk {doc_id}", action="delete", doc_id=doc_id, index=CONTENT_INDEX_NAME)
+            if mirror is not None:
+                mirror.delete(doc_id)
+            term_stats.remove_document(doc_id)
+
+    if mirror is not None:
+        mirror.persist()
+
+    if counts["unchanged"]:
+        progress(f"{counts['unchanged']} unchanged chunks skipped")
+    counts["pages"] = len(pages)
+    return dict(counts)
+
+
+def iter_in_background(iterable, maxsize=PIPELINE_QUEUE_SIZE):
+    #Runs a producer (e.g. PDF parsing) on its own thread, handing items over through a bounded queue
+    #so parsing keeps going while earlier items are embedded and indexed, but never runs far ahead of them
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            items.put((done, None))
+        except Exception as e:
+            items.put((done, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_windows(texts, source, page_number, label):
+    #Chunks of one page/slide/document, cut by the shared sliding-window chunker
+    for chunk_index, chunk in enumerate(sliding_windows(texts)):
+        yield chunk, source, page_number, chunk_index, label
+
+
+def iter_pdf_pages(file_name):
+    #Yields (page_number, text) in page order, for the pages that have text
+    #Pages with (almost) no text layer are sent to ocr_pool as they are found and picked up in order, at most
+    #2 per OCR worker at a time; without OCR installed they are skipped rather than embedded empty
+    from langchain_community.document_loaders import PyPDFLoader
+
+    loader = PyPDFLoader(file_name)
+    ocr = ocr_available()
+    pending = deque()  #(page_number, extracted text, OCR future or None), in page order
+    skipped = 0
+
+    def resolve(page_number, text, future):
+        if future is not None:
+            try:
+                text = max(text, future.result(), key=len)
+            except Exception as e:
+                print(f"OCR failed for page {page_number + 1} of {file_name} - {str(e)}")
+                if isinstance(e, BrokenExecutor):
+                    ocr_pool.clear()  #a worker died, the next pages get a new pool
+        return page_number, text
+
+    try:
+        for page in loader.lazy_load():
+            page_number = page.metadata["page"]
+            if not needs_ocr(page.page_content):
+                pending.append((page_number, page.page_content, None))
+            elif ocr:
+                pending.append((page_number, page.page_content, ocr_pool().submit(ocr_page, file_name, page_number)))
+            else:
+                skipped += 1
+
+            in_flight = sum(future is not None for _, _, future in pending)
+            while pending and (pending[0][2] is None or pending[0][2].done() or in_flight >= OCR_WORKERS * 2):
+                in_flight -= pending[0][2] is not None
+                page_number, text = resolve(*pending.popleft())
+                if not needs_ocr(text):
+                    yield page_number, text
+
+        while pending:
+            page_number, text = resolve(*pending.popleft())
+            if not needs_ocr(text):
+                yield page_number, text
+    finally:
+        for _, _, future in pending:
+            if future is not None:
+                future.cancel()
+
+    if skipped:
+        print(f"{skipped} pages of {file_name} have no text layer and were skipped, install tesseract and poppler to OCR them")
+
+
+def iter_pdf_chunks(file_name, source):
+    #Pages are extracted lazily and chunked one at a time, chunks never span two pages so citations stay right
+    for page_number, text in iter_pdf_pages(file_name):
+        yield from iter_windows([text], source, page_number, f"Page: {page_number}")
+
+
+def iter_ppt_chunks(file_path, original_file_name):
+    from pptx import Presentation
+
+    prs = Presentation(file_path)
+
+    for slide_number, slide in enumerate(prs.slides):
+        # Extracting text from each shape that contains text on the slide
+        texts = [shape.text for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip()]
+
+        # Indexed using just the filename, slide number is 1-indexed
+        yield from iter_windows(texts, original_file_name, slide_number + 1, f"Slide: {slide_number + 1}")
+
+
+def iter_excel_chunks(file_name, original_file_name, max_length=CHUNK_TOKENS * 4):
+    #Blocks of whole rows under the sheet's header, sized like the other formats' chunks
+    #Each block is chunked on its own, so every chunk starts with the header; a block is only split further when a
+    #single row is over the limit
+    from .excel_chunker import iter_blocks, read_sheet_batches  #pandas/openpyxl, only loaded for spreadsheets
+
+    for sheet_name, header, row_batches in read_sheet_batches(file_name):
+        chunk_index = 0
+        for block in iter_blocks(header, row_batches, max_length):
+            if not block.strip():
+                continue
+            for chunk in sliding_windows([block]):
+                yield chunk, f"{original_file_name} - {sheet_name}", sheet_name, chunk_index, f"part of worksheet: {sheet_name}"
+                chunk_index += 1
+
+
+def iter_document_chunks(paragraphs, source):
+    #Documents without pages (HTML, Word, text) are numbered by chunk, shown as "page" 1, 2, ... in citations
+    for part, chunk in enumerate(sliding_windows(paragraphs)):
+        yield chunk, source, part, 0, f"Part: {part + 1}"
+
+
+def iter_file_chunks(file_path, original_file_name, file_type):
+    #Parser for a file type, None for the types that can't be indexed
+    if file_type == 'PDF':
+        return iter_pdf_chunks(file_path, os.path.basename(original_file_name))
+    elif file_type == 'PowerPoint':
+        return iter_ppt_chunks(file_path, original_file_name)
+    elif file_type == 'Excel':
+        return iter_excel_chunks(file_path, original_file_name)
+    elif file_type == 'HTML':
+        return iter_document_chunks(iter_html_text(file_path), os.path.basename(original_file_name))
+    elif file_type == 'Word':
+        return iter_document_chunks(iter_word_text(file_path), os.path.basename(original_file_name))
+    elif file_type == 'Text':
+        return iter_document_chunks(iter_text_file(file_path), os.path.basename(original_file_name))
+    return None
+
+
+def process_pdf(file_name, original_file_name, progress=print):
+    source = os.path.basename(original_file_name)
+
+    return index_chunks(original_file_name, iter_in_background(iter_pdf_chunks(file_name, source)), progress)
+
+
+def process_ppt(file_path, original_file_name, progress=print):
+    return index_chunks(original_file_name, iter_ppt_chunks(file_path, original_file_name), progress)
+
+
+def process_excel(file_name, original_file_name, max_length=CHUNK_TOKENS * 4, progress=print):
+    return index_chunks(original_file_name, iter_in_background(iter_excel_chunks(file_name, original_file_name, max_length)), progress)
+
+
+def process_document(file_path, original_file_name, file_type, progress=print):
+    #HTML, Word and text files
+    return index_chunks(original_file_name, iter_in_background(iter_file_chunks(file_path, original_file_name, file_type)), progress)
+
+
+def determine_file_type(file, extension_to_type):
+    # Get the filename from the uploaded file
+    filename = file.name
+    
+    # Extract the file extension
+    _, file_extension = os.path.splitext(filename)
+    
+    # Normalize the file extension to lowercase to ensure case-insensitive matching
+    file_extension = file_extension.lower()
+
+    # Return the file type based on the file extension, or 'Unknown' if not found
+    return extension_to_type.get(file_extension, 'Unknown')
+
+
+
+def save_uploaded_file(uploaded_file):
+    _, file_extension = os.path.splitext(uploaded_file.name)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp:
+        # Copy in blocks instead of materializing another full copy of the upload with getvalue()
+        uploaded_file.seek(0)
+        shutil.copyfileobj(uploaded_file, tmp, 1024 * 1024)
+        tmp.flush()
+        return tmp.name, uploaded_file.name  # Return both the temporary file path and the original file name
+
+
+def process_files(file_path, original_file_name, file_type, progress=print):
+    if file_type == 'PDF':
+        process_pdf(file_path, original_file_name, progress=progress)
+    elif file_type == 'PowerPoint':
+        process_ppt(file_path, original_file_name, progress=progress)
+    elif file_type == 'Excel':
+        process_excel(file_path, original_file_name, progress=progress)
+    elif file_type in ('HTML', 'Word', 'Text'):
+        process_document(file_path, original_file_name, file_type, progress=progress)
+    elif file_type == 'Archive':
+        from .bulk_ingest import format_summary, ingest_paths  #every supported file in the archive, parsed on a thread of this process
+        summary = ingest_paths([file_path], parse_workers=0, progress=progress, names={file_path: original_file_name})
+        progress(format_summary(summary))
+    else:
+        raise ValueError(f"{file_type} files can't be indexed")
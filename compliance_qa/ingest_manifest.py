@@ -0,0 +1,60 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+#Local record of what the document ingest script has indexed
+#Every chunk gets a deterministic document id (file name + page + chunk number) and the manifest keeps a hash of
+#its content, so re-ingesting a file only embeds and upserts chunks whose content changed, and deletes the
+#chunks that are no longer in the file
+
+
+def make_doc_id(file_name, page_number, chunk_index):
+    return hashlib.sha1(f"{file_name}\x00{page_number}\x00{chunk_index}".encode("utf-8")).hexdigest()
+
+
+def content_hash(model_id, content):
+    #The embedding model is part of the hash, so switching models re-embeds everything
+    return hashlib.sha256((model_id + "\x00" + content).encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+
+    def __init__(self, path="ingest_manifest.sqlite3"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "doc_id TEXT PRIMARY KEY, file TEXT NOT NULL, content_hash TEXT NOT NULL, indexed_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file)")
+        self.db.commit()
+
+    def chunks_for(self, file):
+        #doc_id -> content hash of everything indexed from this file
+        with self.lock:
+            rows = self.db.execute("SELECT doc_id, content_hash FROM chunks WHERE file = ?", (file,)).fetchall()
+        return dict(rows)
+
+    def count_under(self, directory):
+        #Chunks of every file indexed as "<directory>/<file>", e.g. the files of an archive
+        prefix = directory + "/"
+        with self.lock:
+            (count,) = self.db.execute("SELECT COUNT(*) FROM chunks WHERE substr(file, 1, ?) = ?", (len(prefix), prefix)).fetchone()
+        return count
+
+    def record(self, doc_id, file, chunk_hash):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO chunks (doc_id, file, content_hash, indexed_at) VALUES (?, ?, ?, ?)",
+                (doc_id, file, chunk_hash, time.time()),
+            )
+            self.db.commit()
+
+    def remove(self, doc_id):
+        with self.lock:
+            self.db.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self.db.commit()
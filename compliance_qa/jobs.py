@@ -0,0 +1,221 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import ingest
+from .answer_cache import mark_sources_updated
+
+
+#Background ingest jobs
+#Uploads are copied to JOB_SPOOL_DIR and queued in a SQLite table; worker processes claim them one at a time and run
+#ingest.process_files, so several files are parsed on separate cores and nothing depends on a browser tab staying open
+#Per-chunk checkpoints are the ingest manifest: a chunk is recorded there once AOSS confirms it, and process_files
+#skips recorded chunks, so a job picked up again after a crash (its heartbeat went stale) carries on where it stopped
+#
+#   python -m compliance_qa.jobs --workers 4
+
+
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', 'ingest_jobs.sqlite3')
+JOB_SPOOL_DIR = os.environ.get('JOB_SPOOL_DIR', 'ingest_spool')
+HEARTBEAT_INTERVAL = 10 #seconds between a running job's heartbeats
+STALE_AFTER = 60 #a running job without a heartbeat for this long is assumed dead and handed to another worker
+MAX_ATTEMPTS = 3 #a job that keeps killing its worker is failed instead of claimed again
+POLL_INTERVAL = 2
+EVENTS_PER_JOB = 500 #progress messages kept per job
+
+
+class JobQueue:
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, file_path TEXT NOT NULL, original_file_name TEXT NOT NULL, file_type TEXT NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS job_events (id INTEGER PRIMARY KEY, job_id INTEGER NOT NULL, at REAL NOT NULL, message TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id)")
+
+    def enqueue(self, file_path, original_file_name, file_type):
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (file_path, original_file_name, file_type, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (file_path, original_file_name, file_type, time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        #Oldest queued job, or a running one whose worker stopped sending heartbeats
+        #BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'worker died on every attempt', finished_at = ? "
+                    "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                    (now, now - STALE_AFTER, MAX_ATTEMPTS),
+                )
+                job = self.db.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?) ORDER BY id LIMIT 1",
+                    (now - STALE_AFTER,),
+                ).fetchone()
+                if job is not None:
+                    job = dict(job, status="running", attempts=job["attempts"] + 1, worker=worker)
+                    self.db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, error = NULL, "
+                        "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE id = ?",
+                        (worker, now, now, job["id"]),
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return job
+
+    def heartbeat(self, job_id, worker):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ?", (time.time(), job_id, worker))
+
+    def log(self, job_id, message):
+        with self.lock:
+            cursor = self.db.execute("INSERT INTO job_events (job_id, at, message) VALUES (?, ?, ?)", (job_id, time.time(), str(message)))
+            if cursor.lastrowid % 100 == 0:
+                self.db.execute(
+                    "DELETE FROM job_events WHERE job_id = ? AND id NOT IN "
+                    "(SELECT id FROM job_events WHERE job_id = ? ORDER BY id DESC LIMIT ?)",
+                    (job_id, job_id, EVENTS_PER_JOB),
+                )
+
+    def finish(self, job_id, error=None):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                ("failed" if error else "done", error, time.time(), job_id),
+            )
+
+    def retry(self, job_id):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, finished_at = NULL WHERE id = ? AND status = 'failed'",
+                (job_id,),
+            )
+
+    def jobs(self, limit=50):
+        with self.lock:
+            return [dict(row) for row in self.db.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))]
+
+    def events(self, job_id, limit=20):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT at, message FROM job_events WHERE job_id = ? ORDER BY id DESC LIMIT ?", (job_id, limit)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+
+def spool_upload(uploaded_file):
+    #Copy of the upload that outlives the request, removed by the worker once the job is done
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    _, file_extension = os.path.splitext(uploaded_file.name)
+    path = os.path.join(JOB_SPOOL_DIR, uuid.uuid4().hex + file_extension)
+    uploaded_file.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, 1024 * 1024)
+    return path
+
+
+def indexed_chunks(job):
+    #How far a job got - chunks of the file the index has confirmed, or of the files inside an archive
+    if job["file_type"] == 'Archive':
+        return ingest.manifest().count_under(job["original_file_name"])
+    return len(ingest.manifest().chunks_for(job["original_file_name"]))
+
+
+def run_job(queue, job, worker):
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            queue.heartbeat(job["id"], worker)
+
+    heartbeat = threading.Thread(target=beat, daemon=True)
+    heartbeat.start()
+    if job["attempts"] > 1:
+        queue.log(job["id"], f"Resuming, {indexed_chunks(job)} chunks already indexed")
+    try:
+        ingest.process_files(job["file_path"], job["original_file_name"], job["file_type"], progress=lambda message: queue.log(job["id"], message))
+    except Exception as e:
+        queue.log(job["id"], f"An error occurred during processing: {str(e)}")
+        queue.finish(job["id"], error=str(e))
+    else:
+        queue.finish(job["id"])
+        if os.path.exists(job["file_path"]):
+            os.remove(job["file_path"])
+    finally:
+        stop.set()
+        # Cached Q&A answers that cited this file may now be out of date
+        mark_sources_updated(os.environ.get('ANSWER_CACHE_PATH', 'answer_cache.sqlite3'), [job["original_file_name"], os.path.basename(job["original_file_name"])])
+
+
+def worker_loop(queue_path=JOB_QUEUE_PATH, embedding_share=1, stop=None):
+    #One worker process: claims jobs until stop is set
+    #embedding_share splits the Titan quota between the worker processes, each has its own rate limiter
+    ingest.EMBEDDING_MAX_TPS = ingest.EMBEDDING_MAX_TPS * embedding_share
+    queue = JobQueue(queue_path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    while stop is None or not stop.is_set():
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        run_job(queue, job, worker)
+
+
+def start_workers(workers, queue_path=JOB_QUEUE_PATH):
+    #Worker processes are spawned, not forked, so they don't inherit the caller's threads (e.g. the Streamlit server's)
+    if workers > 1 and os.environ.get('LOCAL_INDEX_PATH'):
+        #Every process would persist its own copy of the local index over the others'
+        print("LOCAL_INDEX_PATH is set, running a single ingest worker")
+        workers = 1
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    processes = [
+        context.Process(target=worker_loop, args=(queue_path, 1 / workers, stop), name=f"ingest-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    return processes, stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ingest job workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--queue", default=JOB_QUEUE_PATH)
+    args = parser.parse_args()
+
+    processes, stop = start_workers(args.workers, args.queue)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        #Jobs interrupted here are picked up again (and resumed) once their heartbeat is stale
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
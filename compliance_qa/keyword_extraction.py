@@ -0,0 +1,113 @@
+import math
+import re
+
+
+#Local keyword extraction, an optional fast path in front of the Haiku extract_keywords call
+#Produces the same three keywords: keyword_1 a single most significant term (an error code or regulation identifier
+#when the question has one), keyword_2 a 2-3 word phrase, keyword_3 a 4-5 word search, scored TF-IDF style against
+#the corpus statistics document ingest keeps in term_stats.py
+#The confidence score tells the caller when the result is too weak and Haiku should be asked instead
+
+
+IDENTIFIER_PATTERNS = [
+    re.compile(r"\b(?:Regulation|Directive)\s*\((?:EU|EC)\)\s*(?:No\.?\s*)?\d{2,4}/\d{1,4}\b", re.IGNORECASE),
+    re.compile(r"\b\d{2,4}/\d{1,4}/(?:EU|EC|EEC)\b"),
+    re.compile(r"\bArticle\s+\d+[a-z]?(?:\(\d+\))*", re.IGNORECASE),
+    re.compile(r"\b(?:RTS|ITS)\s*\d+\b"),
+    re.compile(r"\b[A-Z]{2,}(?:[-_][A-Z0-9]+)*[-_]?\d{2,}[A-Z0-9]*\b"),  #error/validation codes, e.g. CON-411, EMIR_VAL_023
+    re.compile(r"\b\d{3,}[-_]?[A-Z]{1,4}\b"),
+]
+
+ACRONYM = re.compile(r"\b(?:MiFID\s*II|MiFIR|[A-Z]{2,}[a-z]?[A-Z0-9]*)\b")
+WORD = re.compile(r"\w+")
+
+STOPWORDS = set("""
+a about above after again against all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers how i if in
+into is it its itself just me more most my no nor not now of off on once only or other our out over own same she
+should so some such than that the their them then there these they this those through to too under until up very was
+we were what when where which while who whom why will with would you your yours
+please tell explain describe mean means need needs required require know regarding related applicable apply
+""".split())
+
+
+def idf(document_frequency, document_count):
+    return math.log((document_count + 1) / (document_frequency + 1)) + 1
+
+
+def content_runs(words):
+    #Runs of consecutive non-stopwords, the YAKE-style candidate phrases
+    runs, run = [], []
+    for word in words:
+        if word.lower() in STOPWORDS:
+            if run:
+                runs.append(run)
+            run = []
+        else:
+            run.append(word)
+    if run:
+        runs.append(run)
+    return runs
+
+
+def extract_keywords_locally(question, stats):
+    #Returns (keyword_1, keyword_2, keyword_3, confidence between 0 and 1)
+    document_count = stats.document_count()
+    words = WORD.findall(question)
+    content_words = [word for word in words if word.lower() not in STOPWORDS]
+    if document_count == 0 or not content_words:
+        return "", "", "", 0.0
+
+    runs = content_runs(words)
+    candidates = set(word.lower() for word in content_words)
+    for run in runs:
+        lowered = [word.lower() for word in run]
+        candidates.update(f"{first} {second}" for first, second in zip(lowered, lowered[1:]))
+    frequencies = stats.document_frequencies(candidates)
+
+    def weight(word):
+        #Words the corpus has never seen (typos, filler verbs) can't help a search much
+        frequency = frequencies.get(word.lower(), 0)
+        return idf(frequency, document_count) if frequency else 0.5
+
+    known = [word for word in content_words if frequencies.get(word.lower())]
+    coverage = len(known) / len(content_words)
+
+    #keyword_1 - an identifier if the question has one, else the known acronym or word with the highest IDF
+    identifier = ""
+    for pattern in IDENTIFIER_PATTERNS:
+        match = pattern.search(question)
+        if match:
+            identifier = match.group(0)
+            break
+    if identifier:
+        keyword_1 = identifier
+    else:
+        acronyms = [word for word in ACRONYM.findall(question) if frequencies.get(word.lower())]
+        pool = acronyms or known or content_words
+        keyword_1 = max(pool, key=weight)
+
+    #keyword_2 - the 2-3 word phrase with the highest summed IDF, preferring phrases the corpus actually contains
+    keyword_2 = ""
+    best_score = 0
+    phrase_in_corpus = False
+    for run in runs:
+        for size in (2, 3):
+            for start in range(len(run) - size + 1):
+                phrase = run[start:start + size]
+                lowered = [word.lower() for word in phrase]
+                in_corpus = all(frequencies.get(f"{first} {second}") for first, second in zip(lowered, lowered[1:]))
+                score = sum(weight(word) for word in phrase) * (1.5 if in_corpus else 1)
+                if score > best_score:
+                    keyword_2, best_score, phrase_in_corpus = " ".join(phrase), score, in_corpus
+    if not keyword_2:
+        keyword_2 = " ".join(sorted(content_words, key=weight, reverse=True)[:2])
+
+    #keyword_3 - the 5 highest IDF content words, kept in question order
+    top = sorted(range(len(content_words)), key=lambda position: weight(content_words[position]), reverse=True)[:5]
+    keyword_3 = " ".join(content_words[position] for position in sorted(top))
+
+    confidence = 0.4 * coverage + (0.4 if identifier else 0) + (0.2 if phrase_in_corpus else 0)
+    if len(content_words) < 3:
+        confidence -= 0.2
+    return keyword_1, keyword_2, keyword_3, max(0.0, min(confidence, 1.0))
@@ -0,0 +1,32 @@
+import os
+import shutil
+from importlib.util import find_spec
+
+
+#OCR for PDF pages without a text layer, e.g. scanned filings
+#A page is rendered with pdf2image (poppler's pdftoppm) and read with pytesseract (the tesseract command); both are
+#optional, without them scanned pages are skipped instead of being indexed as empty vectors
+
+
+OCR_MIN_CHARACTERS = 50 #pages with fewer letters and digits than this are treated as scanned
+OCR_DPI = 300
+OCR_LANGUAGE = os.environ.get('OCR_LANGUAGE', 'eng')
+
+
+def needs_ocr(text):
+    return sum(character.isalnum() for character in text) < OCR_MIN_CHARACTERS
+
+
+def ocr_available():
+    if find_spec('pdf2image') is None or find_spec('pytesseract') is None:
+        return False
+    return shutil.which('tesseract') is not None and shutil.which('pdftoppm') is not None
+
+
+def ocr_page(file_name, page_number, dpi=OCR_DPI, language=OCR_LANGUAGE):
+    #Runs in an OCR worker; page_number is 0-based like PyPDFLoader's, only that page is rendered
+    import pytesseract
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(file_name, dpi=dpi, first_page=page_number + 1, last_page=page_number + 1)
+    return "\n".join(pytesseract.image_to_string(image, lang=language) for image in images)
@@ -0,0 +1,527 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from . import resources, tracing
+from .answer_cache import AnswerCache
+from .context_packing import pack_context
+from .fusion import hits_from_response, reciprocal_rank_fusion
+from .keyword_extraction import extract_keywords_locally
+from .reranking import load_reranker, rerank
+from .resources import CONTENT_INDEX_NAME, INDEX_NAME, resource
+from .retrieval_backends import LocalVectorBackend, LocalVectorIndex, OpenSearchBackend
+from .tracing import TraceRecorder
+from .vector_storage import embedding_cache_id, embedding_model_id, embedding_request, stored_vector
+
+
+#Question answering - the retrieval DAG (embedding, keyword extraction, _msearch, fusion, packing) and the Sonnet call
+#do_it returns the answer, do_it_stream yields it as it is generated; q-and-a-cleaned.py is the Streamlit front-end
+
+
+#Where do_it's searches go - 'opensearch' for the AOSS collection, 'local' for the on-disk index document ingest
+#writes to LOCAL_INDEX_PATH
+RETRIEVAL_BACKEND = os.environ.get('RETRIEVAL_BACKEND', 'opensearch')
+LOCAL_INDEX_PATH = os.environ.get('LOCAL_INDEX_PATH', 'local_index')
+
+#Local keyword extraction - skips the Haiku call when the local keywords score at least LOCAL_KEYWORD_MIN_CONFIDENCE
+#Uses the corpus term statistics document ingest writes to TERM_STATS_PATH
+LOCAL_KEYWORDS = os.environ.get('LOCAL_KEYWORDS', '0') == '1'
+LOCAL_KEYWORD_MIN_CONFIDENCE = float(os.environ.get('LOCAL_KEYWORD_MIN_CONFIDENCE', '0.5'))
+
+#Fusion of the search result lists - Reciprocal Rank Fusion, then the top passages packed under a token budget
+RRF_K = 60
+SEMANTIC_WEIGHT = 1.2
+FUSION_TOP_N = 8
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '6000'))
+MAX_PASSAGE_TOKENS = 1500 #longer passages (e.g. 20,000 character Excel blocks) are trimmed to their best matching span
+
+#Optional local cross-encoder (see reranking.py) - scores the top RERANK_CANDIDATES fused passages against the
+#question and only the best RERANK_TOP_N are packed, instead of the top FUSION_TOP_N by fused rank
+RERANKER = os.environ.get('RERANKER', '')
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', '20'))
+RERANK_TOP_N = int(os.environ.get('RERANK_TOP_N', '4'))
+
+#Retrieval executor settings - independent Bedrock/OpenSearch calls in do_it run concurrently
+RETRIEVAL_MAX_WORKERS = 8
+STAGE_TIMEOUTS = { #seconds each stage may take before do_it continues without its results
+    "query_embedding": 10,
+    "extract_keywords": 30,
+    "keyword_embedding": 10,
+    "search": 20,
+}
+
+@resource
+def answer_cache():
+    return AnswerCache(
+        os.environ.get('ANSWER_CACHE_PATH', 'answer_cache.sqlite3'),
+        threshold=float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.95')), #cosine similarity needed to reuse an answer
+        ttl=int(os.environ.get('ANSWER_CACHE_TTL', str(24 * 60 * 60))),
+    )
+
+
+@resource
+def retrieval_backend():
+    if RETRIEVAL_BACKEND == 'local':
+        return LocalVectorBackend(LocalVectorIndex(LOCAL_INDEX_PATH))
+    return OpenSearchBackend(resources.opensearch(), INDEX_NAME, CONTENT_INDEX_NAME or None)
+
+
+@resource
+def reranker():
+    #Loaded once per process, None when RERANKER is not set
+    if not RERANKER:
+        return None
+    return load_reranker(RERANKER)
+
+
+@resource
+def trace_recorder():
+    #Spans are appended to TRACE_LOG_PATH as OpenTelemetry-shaped JSON lines, set it to "" to only aggregate in memory
+    return TraceRecorder(os.environ.get('TRACE_LOG_PATH', 'traces.jsonl'))
+
+
+def get_embeddings(bedrock, text):
+    modelId = embedding_model_id()
+
+    with tracing.span("embedding", model_id=modelId) as span:
+        embedding = resources.embedding_cache().get(embedding_cache_id(), text)
+        if embedding is not None:
+            span.set(cache_hit=True)
+            return embedding
+
+        body_text = json.dumps(embedding_request(text))
+        accept = 'application/json'
+        contentType='application/json'
+
+        response = bedrock.invoke_model(body=body_text, modelId=modelId, accept=accept, contentType=contentType)
+        response_bytes = response.get('body').read()
+        response_body = json.loads(response_bytes)
+        embedding = response_body.get('embedding')
+
+        span.set(cache_hit=False, bytes_in=len(body_text), bytes_out=len(response_bytes),
+                 tokens_in=response_body.get('inputTextTokenCount'), request_id=bedrock_request_id(response))
+
+    resources.embedding_cache().put(embedding_cache_id(), text, embedding)
+    return embedding
+
+
+def bedrock_request_id(response):
+    return response.get('ResponseMetadata', {}).get('RequestId')
+
+#Get KNN Results
+def build_knn_query(userVectors, k):
+
+    query = {
+        "size": k,
+        "query": {
+            "knn": {
+                "vectors": {
+                    "vector": stored_vector(userVectors), #quantized like the indexed vectors
+                    "k": k
+                }
+            }
+        },
+        "_source": False,
+        #A split vector index has no text, search_all fetches it for the passages that make the context
+        "fields": ["source", "page"] if CONTENT_INDEX_NAME else ["content", "source", "page"],
+    }
+
+    return query
+
+
+def parse_xml(xml, tag):
+  start_tag = f"<{tag}>"
+  end_tag = f"</{tag}>"
+  
+  start_index = xml.find(start_tag)
+  if start_index == -1:
+    return ""
+
+  end_index = xml.find(end_tag)
+  if end_index == -1:
+    return ""
+
+  value = xml[start_index+len(start_tag):end_index]
+  return value
+
+
+def build_llm_prompt(user_input, search_results):
+
+# Builds the Sonnet request body from the user input and the retrieved context, shared by the blocking and streaming calls
+
+
+    ##Setup Prompt
+    system_prompt = f"""
+
+You are a financial compliance expert who will assist users in understanding their compliance and regulatory requirements for Financial operations in Europe
+Based on the provided context in <search_results>, Answer the user's question in a concise manner, provide sources the source link annotation inline and refer to the source page number to where the relevant information can be found. Provide refrences to the source of the infomration in line, and the annotation at the end your response
+Do not include any information outside of the information provided in <search_results>. If the provided context does not contain a valid answer to the question, say so
+The passages in <search_results> are ordered by relevance, most relevant first. Weight the earlier passages slightly higher than the later ones.
+Your answer should be straight forward and simple, dont use examples or make overly specific references to examples or fields
+Do not include any preamble
+
+
+<search_results>
+{search_results}
+</search_results>
+
+Make sure your response is well formatted and human readable 
+
+"""
+
+    prompt = {
+        "anthropic_version":"bedrock-2023-05-31",
+        "max_tokens":1000,
+        "temperature":0.5,
+        "system" : system_prompt,
+        "messages":[
+            {
+                "role":"user",
+                "content":[
+                {
+                    "type":"text",
+                    "text": "<user_question>" +user_input +"</user_question>"
+                }
+                ]
+            },
+            {
+                    "role": "assistant",
+                    "content": "Based on the provided context:"
+            }
+        ]
+    }
+
+    return json.dumps(prompt)
+
+
+def invoke_llm(bedrock, user_input, search_results):
+
+# Uses the Bedrock Client, the user input, and the document template as part of the prompt
+
+    json_prompt = build_llm_prompt(user_input, search_results)
+
+    with tracing.span("llm", model_id="anthropic.claude-3-sonnet-20240229-v1:0", bytes_in=len(json_prompt)) as span:
+        response = bedrock.invoke_model(body=json_prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
+        response_bytes = response.get('body').read()
+        span.set(bytes_out=len(response_bytes), request_id=bedrock_request_id(response))
+
+    #modelId = "anthropic.claude-v2"  # change this to use a different version from the model provider if you want to switch 
+    #accept = "application/json"
+    #contentType = "application/json"
+    #Call the Bedrock API
+    #response = bedrock.invoke_model(
+    #    body=body, modelId=modelId, accept=accept, contentType=contentType
+    #)
+
+    #Parse the Response
+    response_body = json.loads(response_bytes)
+    span.set(tokens_in=response_body.get('usage', {}).get('input_tokens'), tokens_out=response_body.get('usage', {}).get('output_tokens'))
+
+    llmOutput=response_body['content'][0]['text']
+
+    #Return the LLM response
+    return llmOutput
+
+
+def invoke_llm_stream(bedrock, user_input, search_results):
+
+# Same request as invoke_llm, but yields the answer text as Sonnet generates it
+
+    json_prompt = build_llm_prompt(user_input, search_results)
+
+    with tracing.span("llm", model_id="anthropic.claude-3-sonnet-20240229-v1:0", bytes_in=len(json_prompt), streaming=True) as span:
+        started = time.monotonic()
+        response = bedrock.invoke_model_with_response_stream(body=json_prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
+        span.set(request_id=bedrock_request_id(response))
+
+        bytes_out = 0
+        first_token = True
+        for event in response.get('body'):
+            bytes_out += len(event['chunk']['bytes'])
+            chunk = json.loads(event['chunk']['bytes'])
+            if chunk['type'] == 'content_block_delta' and chunk['delta']['type'] == 'text_delta':
+                if first_token:
+                    span.set(time_to_first_token_ms=round((time.monotonic() - started) * 1000, 1))
+                    first_token = False
+                yield chunk['delta']['text']
+            elif chunk['type'] == 'message_stop' and 'amazon-bedrock-invocationMetrics' in chunk:
+                metrics = chunk['amazon-bedrock-invocationMetrics']
+                span.set(tokens_in=metrics.get('inputTokenCount'), tokens_out=metrics.get('outputTokenCount'))
+        span.set(bytes_out=bytes_out)
+
+
+
+def extract_keywords(bedrock, user_input):
+
+# Uses the Bedrock Client, the user input, and the document template as part of the prompt
+
+
+    ##Setup Prompt
+    system_prompt = f"""
+
+You are a financial compliance expert who will assist users in understanding their compliance and regulatory requirements for Financial operations in Europe
+Based on the provided question from the user in <user_question>, extract the top 3 keywords that would be the most helpful for a search
+Use the details in tips and tricks as a reference on how to generate your key words
+
+<tips_and_tricks>
+The first keyword should be a single word that capture the most significant search context (ie. questions about error codes should have the first keyword be the error code in question, and ONLY the error code)
+The second keyword should be a concise (2-3 word) search term that would capture the core search question (ie. NCA rejection)
+the 3rd keyword should resemble a concise google search for the main semantic context of the question. And should be about 4 to 5 words
+</tips_and_tricks>
+
+
+Return your top 3 key word searches in <keyword_1>, <keyword_2>, and <keyword_3>. Dont include any other text other than the keywords in your response
+"""
+
+    prompt = {
+        "anthropic_version":"bedrock-2023-05-31",
+        "max_tokens":1000,
+        "temperature":0.5,
+        "system" : system_prompt,
+        "messages":[
+            {
+                "role":"user",
+                "content":[
+                {
+                    "type":"text",
+                    "text": "<user_question>" +user_input +"</user_question>"
+                }
+                ]
+            },
+            {
+                    "role": "assistant",
+                    "content": "Based on the provided context:"
+            }
+        ]
+    }
+
+    json_prompt = json.dumps(prompt)
+
+    with tracing.span("extract_keywords", model_id="anthropic.claude-3-haiku-20240307-v1:0", bytes_in=len(json_prompt)) as span:
+        response = bedrock.invoke_model(body=json_prompt, modelId="anthropic.claude-3-haiku-20240307-v1:0", accept="application/json", contentType="application/json")
+        response_bytes = response.get('body').read()
+        span.set(bytes_out=len(response_bytes), request_id=bedrock_request_id(response))
+
+    #modelId = "anthropic.claude-v2"  # change this to use a different version from the model provider if you want to switch 
+    #accept = "application/json"
+    #contentType = "application/json"
+    #Call the Bedrock API
+    #response = bedrock.invoke_model(
+    #    body=body, modelId=modelId, accept=accept, contentType=contentType
+    #)
+
+    #Parse the Response
+    response_body = json.loads(response_bytes)
+    span.set(tokens_in=response_body.get('usage', {}).get('input_tokens'), tokens_out=response_body.get('usage', {}).get('output_tokens'))
+
+    llmOutput=response_body['content'][0]['text']
+
+    keyword_1 = parse_xml(llmOutput, "keyword_1")
+    keyword_2 = parse_xml(llmOutput, "keyword_2")
+    keyword_3 = parse_xml(llmOutput, "keyword_3")
+
+    print(f"keyword_1: {keyword_1}")
+    print(f"keyword_2: {keyword_2}")
+    print(f"keyword_3: {keyword_3}")
+
+    #Return the LLM response
+    return keyword_1, keyword_2, keyword_3
+
+
+def build_keyword_query(keyword):
+
+    query_1={
+        "size": 3,  # Limits the number of search results to 3
+        "query": {
+            "bool": {
+                "should": [
+                    {
+                        "match": {
+                            "content": keyword
+                        }
+                    }
+                ],
+                "minimum_should_match": 1  # Ensures at least one 'match' must be true
+            }
+        },
+        "_source": ["content", "source", "page"],  # Specify which fields to include in the response
+        "highlight": {  #Optional, to highlight matches in the content field
+            "fields": {
+                "content": {}
+            }
+        }
+    }
+
+    return query_1
+
+
+def get_keywords(bedrock, user_input):
+    #Local keyword extraction when LOCAL_KEYWORDS is on and confident enough, otherwise the Haiku call
+    if LOCAL_KEYWORDS:
+        with tracing.span("extract_keywords_local") as span:
+            keyword_1, keyword_2, keyword_3, confidence = extract_keywords_locally(user_input, resources.term_stats())
+            span.set(confidence=round(confidence, 2), used=confidence >= LOCAL_KEYWORD_MIN_CONFIDENCE)
+        print(f"local keywords ({confidence:.2f}): {keyword_1} | {keyword_2} | {keyword_3}")
+        if confidence >= LOCAL_KEYWORD_MIN_CONFIDENCE:
+            return keyword_1, keyword_2, keyword_3
+
+    return extract_keywords(bedrock, user_input)
+
+
+def search_all(backend, question, userVectors, keywords, keyword_vectors, executor=None):
+    #Run the semantic, keyword and keyword-semantic searches for one question in a single batch and fuse them
+    #Returns (context, sources cited in the context, whether the semantic search returned anything)
+    queries = [build_knn_query(userVectors, 5)] if userVectors else []
+    queries += [build_keyword_query(keyword) for keyword in keywords]
+    queries += [build_knn_query(vectors, 3) for vectors in keyword_vectors]
+
+    with tracing.span("search", backend=type(backend).__name__, queries=len(queries)) as span:
+        responses = backend.msearch(queries, executor)
+        span.set(bytes_in=sum(len(json.dumps(query)) for query in queries),
+                 bytes_out=sum(len(json.dumps(response)) for response in responses),
+                 took_ms=[response.get("took") for response in responses])
+    ranked_lists = [hits_from_response(response) for response in responses]
+
+    #The semantic search on the full question counts slightly more than each keyword search
+    weights = [SEMANTIC_WEIGHT if userVectors else 1.0] + [1.0] * (len(ranked_lists) - 1)
+    fused = reciprocal_rank_fusion(ranked_lists, weights, k=RRF_K)
+    cross_encoder = reranker()
+    top = fused[:RERANK_CANDIDATES if cross_encoder is not None else FUSION_TOP_N]
+
+    #Only the passages that can make it into the context (or the reranker's candidates) have their text fetched
+    missing = [hit["id"] for hit in top if not hit["content"]]
+    if missing:
+        with tracing.span("fetch_content", documents=len(missing)) as span:
+            contents = backend.contents(missing)
+            span.set(found=len(contents))
+        for hit in top:
+            if not hit["content"]:
+                hit["content"] = contents.get(hit["id"], "")
+
+    if cross_encoder is not None:
+        candidates = [hit for hit in top if hit["content"].strip()]
+        with tracing.span("rerank", model=cross_encoder.name, candidates=len(candidates)) as span:
+            try:
+                top = rerank(cross_encoder, question, candidates, RERANK_TOP_N)
+                span.set(kept=len(top))
+            except Exception as e:
+                print(f"Reranking failed, packing by fused rank: {str(e)}")
+                top = top[:FUSION_TOP_N]
+                span.set(error=str(e))
+
+    with tracing.span("pack_context") as span:
+        context, used_hits, packed_tokens = pack_context(top, question, CONTEXT_TOKEN_BUDGET, MAX_PASSAGE_TOKENS)
+        span.set(hits=sum(len(hits) for hits in ranked_lists), unique_hits=len(fused), passages=len(used_hits), tokens_out=packed_tokens,
+                 bytes_out=len(context))
+    sources = {hit["source"] for hit in used_hits}
+    print(f"fused_results:-------------------------- {len(fused)} unique of {sum(len(hits) for hits in ranked_lists)} hits, {len(used_hits)} packed in ~{packed_tokens} tokens ----------------------------------")
+
+    return context, sources, bool(userVectors and ranked_lists and ranked_lists[0])
+
+
+def submit_stage(executor, stage, fn, *args):
+    #Start a retrieval stage and remember when its timeout runs out
+    deadline = time.monotonic() + STAGE_TIMEOUTS[stage]
+    return stage, deadline, tracing.submit_in_context(executor, traced_stage, stage, fn, *args)
+
+
+def traced_stage(stage, fn, *args):
+    with tracing.span(f"stage.{stage}"):
+        return fn(*args)
+
+
+def stage_result(submitted, default=""):
+    #Wait for a retrieval stage, falling back to a partial (empty) result on timeout or error
+    stage, deadline, future = submitted
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        print(f"{stage} timed out after {STAGE_TIMEOUTS[stage]}s, continuing without it")
+    except Exception as e:
+        print(f"{stage} failed, continuing without it: {str(e)}")
+    return default
+
+
+def retrieve_context(userQuery):
+    #Runs the retrieval DAG for a question
+    #Returns (cached_answer, userVectors, context, (sources, complete))
+    bedrock = resources.bedrock()
+    executor = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS)
+    try:
+        #Stage 1 - the query embedding, and with it the answer cache lookup
+        query_embedding_stage = submit_stage(executor, "query_embedding", get_embeddings, bedrock, userQuery)
+
+        #A semantically equivalent question answered recently skips retrieval and the LLM entirely
+        userVectors = stage_result(query_embedding_stage, default=None)
+        if userVectors:
+            with tracing.span("answer_cache") as span:
+                cached_answer = answer_cache().get(userVectors)
+                span.set(cache_hit=cached_answer is not None)
+            if cached_answer is not None:
+                print("Answer served from cache")
+                return cached_answer, userVectors, None, None
+
+        #Keyword extraction waits for the cache miss, so a cache hit never pays for a Haiku call
+        keywords_stage = submit_stage(executor, "extract_keywords", get_keywords, bedrock, userQuery)
+        keywords = stage_result(keywords_stage, default=("", "", ""))
+        keywords = [keyword for keyword in keywords if keyword.strip()]
+
+        #Stage 2 - the keyword embeddings only need the keywords
+        keyword_embedding_stages = [submit_stage(executor, "keyword_embedding", get_embeddings, bedrock, keyword) for keyword in keywords]
+        keyword_vectors = [stage_result(stage, default=None) for stage in keyword_embedding_stages]
+        keyword_vectors = [vectors for vectors in keyword_vectors if vectors]
+
+        #Stage 3 - every lexical and kNN sub-query goes out in one _msearch
+        search_stage = submit_stage(executor, "search", search_all, retrieval_backend(), userQuery, userVectors, keywords, keyword_vectors, executor)
+        context, sources, complete = stage_result(search_stage, default=("", set(), False))
+    finally:
+        #Don't hold the answer back for stages that already timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return None, userVectors, context, (sources, complete)
+
+
+def cache_answer(userVectors, userQuery, llmOutput, citations):
+    #Only cache answers built on a complete semantic search, not on a partial-result fallback
+    sources, complete = citations
+    if userVectors and complete:
+        answer_cache().put(userVectors, userQuery, llmOutput, sources)
+
+
+def do_it(userQuery, trace=None):
+    #Pass a tracing.Trace to look at the per-stage timings afterwards, every trace is also recorded
+    trace = trace or tracing.Trace()
+    try:
+        with trace.activate():
+            cached_answer, userVectors, context, citations = retrieve_context(userQuery)
+            if cached_answer is not None:
+                return cached_answer
+
+            llmOutput = invoke_llm(resources.bedrock(), userQuery, context)
+
+            cache_answer(userVectors, userQuery, llmOutput, citations)
+            return llmOutput
+    finally:
+        trace_recorder().record(trace)
+
+
+def do_it_stream(userQuery, trace=None):
+    #Streaming version of do_it (e.g. for st.write_stream), the full answer is still collected for the cache and the log
+    trace = trace or tracing.Trace()
+    try:
+        with trace.activate():
+            cached_answer, userVectors, context, citations = retrieve_context(userQuery)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+
+            llmOutput = ""
+            for text in invoke_llm_stream(resources.bedrock(), userQuery, context):
+                llmOutput += text
+                yield text
+
+            cache_answer(userVectors, userQuery, llmOutput, citations)
+    finally:
+        trace_recorder().record(trace)
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+from .context_packing import WORD, best_span
+
+
+#Cross-encoder reranking of the fused passages, run on the CPU before context packing
+#A cross-encoder reads the question and a passage together and scores how well the passage answers it, which the
+#separate kNN/BM25 scores can't; only the best few passages then go to Sonnet
+#
+#RERANKER is either a directory with an ONNX export of the model (model.onnx and tokenizer.json, e.g.
+#   optimum-cli export onnx --model cross-encoder/ms-marco-MiniLM-L-6-v2 ms-marco-minilm-onnx
+#run with onnxruntime and tokenizers) or a model name for sentence-transformers' CrossEncoder (needs torch)
+#Long passages are scored on their span that best matches the question, as context packing would trim them
+
+
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_LENGTH = 512 #model tokens per question + passage pair
+RERANK_PASSAGE_TOKENS = 300 #estimated tokens of a passage that are scored
+RERANK_THREADS = int(os.environ.get('RERANK_THREADS', '0')) #onnxruntime intra-op threads, 0 for its default
+
+
+class OnnxCrossEncoder:
+
+    def __init__(self, model_dir, max_length=RERANK_MAX_LENGTH, threads=RERANK_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.name = os.path.basename(os.path.normpath(model_dir))
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"])
+        self.inputs = {model_input.name for model_input in self.session.get_inputs()}
+
+    def predict(self, pairs, batch_size=RERANK_BATCH_SIZE):
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            encodings = self.tokenizer.encode_batch(pairs[start:start + batch_size])
+            feed = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            logits = self.session.run(None, {name: value for name, value in feed.items() if name in self.inputs})[0]
+            #One relevance logit per pair, or (not relevant, relevant) for two-class models
+            scores.extend(logits.reshape(len(encodings), -1)[:, -1].tolist())
+        return scores
+
+
+class SentenceTransformersCrossEncoder:
+
+    def __init__(self, model_name, max_length=RERANK_MAX_LENGTH):
+        from sentence_transformers import CrossEncoder
+
+        self.name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def predict(self, pairs, batch_size=RERANK_BATCH_SIZE):
+        return [float(score) for score in self.model.predict(pairs, batch_size=batch_size, show_progress_bar=False)]
+
+
+def load_reranker(model):
+    if os.path.isfile(os.path.join(model, "model.onnx")):
+        return OnnxCrossEncoder(model)
+    return SentenceTransformersCrossEncoder(model)
+
+
+def rerank(reranker, question, hits, top_n):
+    #The top_n hits by cross-encoder score, each with its "rerank_score"
+    question_terms = set(WORD.findall(question.lower()))
+    pairs = [(question, best_span(hit["content"], question_terms, RERANK_PASSAGE_TOKENS)) for hit in hits]
+    scores = reranker.predict(pairs) if pairs else []
+    ranked = sorted((dict(hit, rerank_score=score) for hit, score in zip(hits, scores)), key=lambda hit: hit["rerank_score"], reverse=True)
+    return ranked[:top_n]
@@ -0,0 +1,92 @@
+import os
+import threading
+from functools import wraps
+
+from .embedding_cache import EmbeddingCache
+from .term_stats import TermStats
+
+
+#Process-wide clients and caches shared by the Q&A and ingest modules
+#Nothing is built at import time: a @resource function runs on its first call and every later call gets the same
+#object back - the library version of st.cache_resource, so Streamlit reruns and other callers (bench, services)
+#reuse one set of connection pools
+#boto3 and opensearch-py are imported inside the factories, only when a client is actually needed
+
+
+INDEX_NAME = os.environ.get('OPENSEARCH_INDEX', 'INDEXNAME') #Use your index
+#Optional index holding the chunk text apart from the vectors, see vector_storage.py
+CONTENT_INDEX_NAME = os.environ.get('OPENSEARCH_CONTENT_INDEX', '')
+OPENSEARCH_HOST = os.environ.get('OPENSEARCH_HOST', 'HOSTNAME') #use Opensearch Serverless host here
+OPENSEARCH_REGION = os.environ.get('OPENSEARCH_REGION', 'REGION') # set region of you Opensearch severless collection
+OPENSEARCH_POOL_SIZE = int(os.environ.get('OPENSEARCH_POOL_SIZE', '20'))
+BEDROCK_REGION = 'us-east-1'
+#Sized for the ingest embedding workers plus the retrieval stages of a few concurrent questions
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.environ.get('BEDROCK_MAX_POOL_CONNECTIONS', '32'))
+
+registry = []
+
+
+def resource(factory):
+    lock = threading.Lock()
+    created = []
+
+    @wraps(factory)
+    def get():
+        if not created:
+            with lock:
+                if not created:
+                    created.append(factory())
+        return created[0]
+
+    def clear():
+        with lock:
+            created.clear()
+
+    get.clear = clear
+    registry.append(get)
+    return get
+
+
+def clear_all():
+    #Drops every created resource, the next call builds it again (e.g. after changing the cache paths)
+    for get in registry:
+        get.clear()
+
+
+@resource
+def bedrock():
+    import boto3
+    import botocore
+
+    config = botocore.config.Config(connect_timeout=300, read_timeout=300, max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS)
+    return boto3.client('bedrock-runtime', BEDROCK_REGION, config=config)
+
+
+@resource
+def opensearch():
+    import boto3
+    from opensearchpy import AWSV4SignerAuth, OpenSearch, RequestsHttpConnection
+
+    credentials = boto3.Session().get_credentials() #Use enviroment credentials
+    auth = AWSV4SignerAuth(credentials, OPENSEARCH_REGION, 'aoss')
+
+    return OpenSearch(
+        hosts = [{'host': OPENSEARCH_HOST, 'port': 443}],
+        http_auth = auth,
+        use_ssl = True,
+        verify_certs = True,
+        connection_class = RequestsHttpConnection,
+        pool_maxsize = OPENSEARCH_POOL_SIZE
+    )
+
+
+@resource
+def embedding_cache():
+    #Shared by ingest and Q&A, the in-memory tier lives as long as the process
+    return EmbeddingCache(os.environ.get('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite3'))
+
+
+@resource
+def term_stats():
+    #Written by ingest, read by the Q&A local keyword extractor
+    return TermStats(os.environ.get('TERM_STATS_PATH', 'term_stats.sqlite3'))
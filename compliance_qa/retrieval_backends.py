@@ -0,0 +1,345 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+
+#Retrieval backends for the Q&A script
+#Every backend answers the same OpenSearch query bodies q-and-a-cleaned.py builds (kNN on "vectors", match on "content")
+#and returns OpenSearch shaped responses, so the hit formatting and the rest of do_it don't care where results come from
+#OpenSearchBackend is the AOSS collection, LocalVectorBackend is an in-process index on disk that document ingest
+#fills with the same records it writes to AOSS
+#contents() fetches the text of hits that came back without it (kNN hits of a vector index split from its content)
+
+
+MSEARCH_UNSUPPORTED_STATUSES = (400, 404, 405) #how a collection without _msearch answers it; anything else is transient
+
+
+class RetrievalBackend:
+
+    def search(self, body):
+        raise NotImplementedError
+
+    def msearch(self, bodies, executor=None):
+        mapper = executor.map if executor is not None else map
+        return list(mapper(self.search, bodies))
+
+    def contents(self, ids):
+        #{doc id: content} of the given documents, one ids query
+        response = self.search({"size": len(ids), "query": {"ids": {"values": list(ids)}}, "_source": ["content"]})
+        return {hit["_id"]: hit["_source"].get("content", "") for hit in response["hits"]["hits"]}
+
+
+class OpenSearchBackend(RetrievalBackend):
+
+    def __init__(self, client, index, content_index=None):
+        self.client = client
+        self.index = index
+        self.content_index = content_index or index  #keyword and ids queries go here, kNN queries to index
+        #Set to False once _msearch turns out to be unsupported so later questions go straight to individual searches
+        self.msearch_available = True
+
+    def index_for(self, body):
+        return self.index if "knn" in body["query"] else self.content_index
+
+    def search(self, body):
+        return self.client.search(body=body, index=self.index_for(body))
+
+    def msearch(self, bodies, executor=None):
+        #Send every sub-query for a question as one _msearch round trip (one SigV4 signature, one HTTPS request)
+        #Falls back to individual searches when _msearch fails - for good when it is unsupported, for this question
+        #only on a timeout, throttling or other transient error - and retries single sub-queries that errored
+        responses = [None] * len(bodies)
+        if self.msearch_available and bodies:
+            body = []
+            for query in bodies:
+                body.append({"index": self.index_for(query)})
+                body.append(query)
+            try:
+                responses = self.client.msearch(body=body, index=self.index)["responses"]
+            except Exception as e:
+                if getattr(e, "status_code", None) in MSEARCH_UNSUPPORTED_STATUSES:
+                    print(f"_msearch unsupported, using individual searches from now on: {str(e)}")
+                    self.msearch_available = False
+                else:
+                    print(f"_msearch failed, falling back to individual searches for this question: {str(e)}")
+
+        def search_one(position):
+            response = responses[position]
+            if response is not None and "error" not in response:
+                return response
+            return self.search(bodies[position])
+
+        mapper = executor.map if executor is not None else map
+        return list(mapper(search_one, range(len(bodies))))
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class LocalVectorIndex:
+    #float32 vector matrix (memory-mapped when loaded from disk) plus the content/source/page of every record
+    #kNN is exact NumPy brute force, or HNSW (hnswlib, when installed) once the corpus reaches hnsw_min_documents;
+    #the graph is built by persist and saved next to the vectors, so a query never waits for it. Records added or
+    #changed since the graph was built are searched by brute force next to it until the next persist
+    #Keyword search is BM25 over an inverted index built on first use
+    #Searches return the documents themselves, read under the lock, so a reload can't swap the rows out from under them
+
+    def __init__(self, path, hnsw_min_documents=50000):
+        self.path = path
+        self.hnsw_min_documents = hnsw_min_documents
+        self.lock = threading.Lock()
+        self.loaded_version = None
+        self._clear()
+        if os.path.exists(self._file("meta.json")):
+            self.load()
+
+    def _clear(self):
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.documents = []  #{"id", "content", "source", "page"} per row of self.vectors
+        self.rows = {}  #doc id -> row
+        self.deleted = set()
+        self.count = 0
+        self.postings = None
+        self.norms = None
+        self.hnsw = None
+        self.hnsw_rows = 0  #rows 0..hnsw_rows-1 are in the graph
+        self.hnsw_stale = set()  #graph rows whose record changed since, searched by brute force
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def add(self, doc_id, vectors, content, source, page):
+        with self.lock:
+            vector = np.asarray(vectors, dtype=np.float32)
+            if self.count == 0 and self.vectors.shape[1] != len(vector):
+                self.vectors = np.zeros((1024, len(vector)), dtype=np.float32)
+            elif not self.vectors.flags.writeable:
+                self.vectors = np.array(self.vectors)  #copy out of the read-only memory map before changing it
+
+            document = {"id": doc_id, "content": content, "source": source, "page": page}
+            row = self.rows.get(doc_id)
+            if row is None:
+                row = self.count
+                if row >= len(self.vectors):
+                    self.vectors = np.concatenate([self.vectors, np.zeros((max(row, 1024), len(vector)), dtype=np.float32)])
+                self.documents.append(document)
+                self.rows[doc_id] = row
+                self.count += 1
+            else:
+                self.documents[row] = document
+            self.vectors[row] = vector
+            self.deleted.discard(row)
+            self.postings = None
+            self.norms = None
+            if row < self.hnsw_rows:
+                self.hnsw_stale.add(row)  #the graph still has the old vector
+
+    def delete(self, doc_id):
+        with self.lock:
+            row = self.rows.get(doc_id)
+            if row is not None:
+                self.deleted.add(row)
+
+    def persist(self):
+        #Deleted rows are dropped here; files are swapped in atomically so a reader never sees half a write
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            keep = [row for row in range(self.count) if row not in self.deleted]
+            vectors = self.vectors[keep] if self.count else self.vectors[:0]
+            documents = [self.documents[row] for row in keep]
+
+            with open(self._file("vectors.npy.tmp"), "wb") as f:
+                np.save(f, vectors)
+            with open(self._file("documents.jsonl.tmp"), "w") as f:
+                for document in documents:
+                    f.write(json.dumps(document) + "\n")
+            version = os.urandom(8).hex()
+            #The graph file is named after its version, a reader loading the previous meta.json still finds its own
+            hnsw = self._build_hnsw(vectors) if len(documents) >= self.hnsw_min_documents else None
+            hnsw_file = f"hnsw-{version}.bin" if hnsw is not None else None
+            if hnsw is not None:
+                hnsw.save_index(self._file(hnsw_file))
+            with open(self._file("meta.json.tmp"), "w") as f:
+                json.dump({"count": len(documents), "dimensions": vectors.shape[1], "version": version, "hnsw": hnsw_file}, f)
+
+            os.replace(self._file("vectors.npy.tmp"), self._file("vectors.npy"))
+            os.replace(self._file("documents.jsonl.tmp"), self._file("documents.jsonl"))
+            os.replace(self._file("meta.json.tmp"), self._file("meta.json"))
+            for name in os.listdir(self.path):
+                if name.startswith("hnsw-") and name != hnsw_file:
+                    os.remove(self._file(name))
+
+            #Rows are renumbered without the deleted ones, like load would see them
+            self.vectors = vectors
+            self.documents = documents
+            self.rows = {document["id"]: row for row, document in enumerate(documents)}
+            self.deleted = set()
+            self.count = len(documents)
+            self.postings = None
+            self.norms = None
+            self.hnsw = hnsw
+            self.hnsw_rows = self.count if hnsw is not None else 0
+            self.hnsw_stale = set()
+            self.loaded_version = version
+
+    def load(self):
+        with open(self._file("meta.json")) as f:
+            meta = json.load(f)
+        vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+        with open(self._file("documents.jsonl")) as f:
+            documents = [json.loads(line) for line in f]
+        if not meta["count"] == len(vectors) == len(documents):
+            #Caught between two of persist's file swaps, the next query tries again
+            raise ValueError("local vector index is being rewritten")
+        hnsw = self._load_hnsw(meta, vectors.shape[1])
+
+        with self.lock:
+            self._clear()
+            self.vectors = vectors
+            self.documents = documents
+            self.rows = {document["id"]: row for row, document in enumerate(documents)}
+            self.count = len(documents)
+            self.hnsw = hnsw
+            self.hnsw_rows = self.count if hnsw is not None else 0
+            self.loaded_version = meta["version"]
+
+    def reload_if_changed(self):
+        #Cheap check on every query so the Q&A side picks up what ingest persisted
+        try:
+            with open(self._file("meta.json")) as f:
+                version = json.load(f)["version"]
+        except (OSError, ValueError, KeyError):
+            return
+        if version != self.loaded_version:
+            try:
+                self.load()
+            except (OSError, ValueError, RuntimeError) as e:
+                print(f"Keeping the previous local vector index: {str(e)}")
+
+    def knn(self, vector, k):
+        #[(document, score)] of the k nearest records
+        with self.lock:
+            live = self.count - len(self.deleted)
+            if live <= 0:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            k = min(k, live)
+
+            if self.hnsw is not None:
+                skipped = self.deleted | self.hnsw_stale
+                labels, _ = self.hnsw.knn_query(query, k=min(k + len(skipped), self.hnsw_rows))
+                rows = [int(row) for row in labels[0] if row not in skipped]
+                #Plus every record the graph doesn't have yet, compared exactly
+                rows += [row for row in range(self.hnsw_rows, self.count) if row not in self.deleted]
+                rows += [row for row in self.hnsw_stale if row not in self.deleted]
+                rows = np.array(rows, dtype=np.int64)
+                distances = ((self.vectors[rows] - query) ** 2).sum(axis=1)
+            else:
+                #||v - q||^2 = ||v||^2 - 2 v.q + ||q||^2, computed straight off the memory map without copying it
+                if self.norms is None:
+                    self.norms = np.einsum("ij,ij->i", self.vectors[:self.count], self.vectors[:self.count])
+                distances = self.norms - 2 * (self.vectors[:self.count] @ query) + query @ query
+                if self.deleted:
+                    distances[list(self.deleted)] = np.inf
+                rows = np.argpartition(distances, k - 1)[:k]
+                distances = distances[rows]
+
+            order = np.argsort(distances)[:k]
+            #Same score the AOSS l2 space reports: 1 / (1 + squared distance)
+            return [(self.documents[rows[i]], float(1 / (1 + max(distances[i], 0)))) for i in order]
+
+    def match(self, text, size, k1=1.2, b=0.75):
+        #[(document, score)] of the size best BM25 matches
+        with self.lock:
+            if self.postings is None:
+                self._build_postings()
+            live = self.count - len(self.deleted)
+            scores = Counter()
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term, {})
+                if not postings:
+                    continue
+                idf = math.log(1 + (live - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row, frequency in postings.items():
+                    if row in self.deleted:
+                        continue
+                    norm = k1 * (1 - b + b * self.lengths[row] / self.average_length)
+                    scores[row] += idf * frequency * (k1 + 1) / (frequency + norm)
+            return [(self.documents[row], score) for row, score in scores.most_common(size)]
+
+    def documents_by_id(self, doc_ids):
+        with self.lock:
+            rows = [self.rows.get(doc_id) for doc_id in doc_ids]
+            return [self.documents[row] for row in rows if row is not None and row not in self.deleted]
+
+    def _build_postings(self):
+        self.postings = {}
+        self.lengths = np.zeros(self.count)
+        for row in range(self.count):
+            terms = Counter(tokenize(self.documents[row]["content"]))
+            self.lengths[row] = sum(terms.values())
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[row] = frequency
+        self.average_length = max(self.lengths.mean(), 1) if self.count else 1
+
+    @staticmethod
+    def _build_hnsw(vectors):
+        try:
+            import hnswlib
+        except ImportError:
+            return None
+        hnsw = hnswlib.Index(space="l2", dim=vectors.shape[1])
+        hnsw.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+        hnsw.add_items(np.asarray(vectors), np.arange(len(vectors)))
+        hnsw.set_ef(100)
+        return hnsw
+
+    def _load_hnsw(self, meta, dimensions):
+        #None (brute force) when persist didn't build a graph or hnswlib isn't installed on this side
+        if not meta.get("hnsw"):
+            return None
+        try:
+            import hnswlib
+        except ImportError:
+            return None
+        hnsw = hnswlib.Index(space="l2", dim=dimensions)
+        hnsw.load_index(self._file(meta["hnsw"]), max_elements=meta["count"])
+        hnsw.set_ef(100)
+        return hnsw
+
+
+class LocalVectorBackend(RetrievalBackend):
+
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, body):
+        self.index.reload_if_changed()
+        query = body["query"]
+        size = body.get("size", 10)
+
+        if "knn" in query:
+            knn = query["knn"]["vectors"]
+            results = self.index.knn(knn["vector"], min(knn["k"], size))
+            #kNN queries ask for "fields", which OpenSearch returns as lists
+            hits = [self._hit(document, score, lambda value: {"fields": {key: [item] for key, item in value.items()}}) for document, score in results]
+        elif "ids" in query:
+            documents = self.index.documents_by_id(query["ids"]["values"])
+            hits = [self._hit(document, 1.0, lambda value: {"_source": value}) for document in documents]
+        else:
+            text = query["bool"]["should"][0]["match"]["content"]
+            results = self.index.match(text, size)
+            hits = [self._hit(document, score, lambda value: {"_source": value}) for document, score in results]
+
+        return {"hits": {"hits": hits}}
+
+    def _hit(self, document, score, shape):
+        hit = {"_id": document["id"], "_score": score}
+        hit.update(shape({"content": document["content"], "source": document["source"], "page": document["page"]}))
+        return hit
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from . import qa, resources
+
+
+#HTTP API over the Q&A pipeline for internal tools and chatbots
+#
+#   uvicorn compliance_qa.service:app --host 0.0.0.0 --port 8000
+#
+#POST /ask returns the whole answer, POST /ask/stream (or GET /ask/stream?question=... for EventSource) sends it as
+#server-sent events while Sonnet generates it
+#The pipeline is blocking boto3/opensearch-py code, so every question runs on a worker thread. At most
+#MAX_CONCURRENT_QUESTIONS run at once, up to MAX_QUEUED_QUESTIONS more wait for a slot and the rest get a 503
+#Identical questions asked while one is in flight share its run: they follow the same Broadcast from its first token
+#All questions share the clients in resources.py - size BEDROCK_MAX_POOL_CONNECTIONS for about 4 concurrent Bedrock
+#calls per question and OPENSEARCH_POOL_SIZE for one per question
+
+
+MAX_CONCURRENT_QUESTIONS = int(os.environ.get('MAX_CONCURRENT_QUESTIONS', '32'))
+MAX_QUEUED_QUESTIONS = int(os.environ.get('MAX_QUEUED_QUESTIONS', '256'))
+RETRY_AFTER_SECONDS = 5
+
+
+class Question(BaseModel):
+    question: str
+
+
+def question_key(question):
+    #Questions that only differ in case or whitespace are the same pipeline run
+    return re.sub(r"\s+", " ", question).strip().casefold()
+
+
+class Broadcast:
+    #Answer text of one pipeline run, published from its worker thread and followed by any number of requests
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def publish(self, chunk=None, done=False, error=None):
+        #Called from the worker thread, the state is only ever changed on the event loop
+        self.loop.call_soon_threadsafe(self._publish, chunk, done, error)
+
+    def _publish(self, chunk, done, error):
+        if chunk is not None:
+            self.chunks.append(chunk)
+        if done:
+            self.done = True
+            self.error = error
+        self.changed.set()
+
+    async def follow(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            self.changed.clear()
+            await self.changed.wait()
+
+
+class QuestionRunner:
+
+    def __init__(self, max_concurrent, max_queued):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="question")
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.capacity = max_concurrent + max_queued  #questions running or waiting for a slot before new ones get a 503
+        self.in_flight = {}  #question key -> Broadcast
+        self.tasks = set()
+        self.accepted = 0  #running plus waiting
+        self.waiting = 0
+        self.coalesced = 0
+
+    def ask(self, question):
+        key = question_key(question)
+        broadcast = self.in_flight.get(key)
+        if broadcast is not None:
+            self.coalesced += 1
+            return broadcast
+
+        if self.accepted >= self.capacity:
+            raise HTTPException(503, "Too many questions waiting, try again shortly", headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+        broadcast = Broadcast(asyncio.get_running_loop())
+        self.in_flight[key] = broadcast
+        self.accepted += 1  #counted right away, so a burst of requests can't all pass the check above
+        self.waiting += 1
+        task = asyncio.create_task(self._run(key, question, broadcast))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return broadcast
+
+    async def _run(self, key, question, broadcast):
+        try:
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self._pipeline, question, broadcast)
+            except Exception as e:
+                broadcast.publish(done=True, error=e)
+            finally:
+                self.slots.release()
+        finally:
+            self.accepted -= 1
+            self.in_flight.pop(key, None)
+
+    def _pipeline(self, question, broadcast):
+        try:
+            for text in qa.do_it_stream(question):
+                broadcast.publish(text)
+        except Exception as e:
+            print(f"Question failed: {str(e)}")
+            broadcast.publish(done=True, error=e)
+            return
+        broadcast.publish(done=True)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def warm_up():
+    #Build the clients and caches before the first question instead of during it
+    resources.bedrock()
+    resources.embedding_cache()
+    qa.retrieval_backend()
+    qa.reranker()
+    qa.answer_cache()
+    qa.trace_recorder()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.runner = QuestionRunner(MAX_CONCURRENT_QUESTIONS, MAX_QUEUED_QUESTIONS)
+    await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    yield
+    app.state.runner.shutdown()
+
+
+app = FastAPI(title="Compliance Q+A", lifespan=lifespan)
+
+
+def start(question):
+    if not question.strip():
+        raise HTTPException(400, "question is empty")
+    return app.state.runner.ask(question)
+
+
+@app.post("/ask")
+async def ask(request: Question):
+    broadcast = start(request.question)
+    try:
+        answer = "".join([text async for text in broadcast.follow()])
+    except Exception as e:
+        raise HTTPException(502, f"Could not answer the question: {str(e)}")
+    return {"answer": answer}
+
+
+def event_stream(broadcast):
+    async def events():
+        try:
+            async for text in broadcast.follow():
+                yield f"data: {json.dumps({'text': text})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/ask/stream")
+async def ask_stream(request: Question):
+    return event_stream(start(request.question))
+
+
+@app.get("/ask/stream")
+async def ask_stream_get(question: str):
+    return event_stream(start(question))
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+async def stats():
+    runner = app.state.runner
+    return {
+        "in_flight": len(runner.in_flight),
+        "running": runner.accepted - runner.waiting,
+        "waiting": runner.waiting,
+        "coalesced": runner.coalesced,
+        "stages": qa.trace_recorder().percentiles(),
+    }
@@ -0,0 +1,71 @@
+import json
+import re
+import sqlite3
+import threading
+
+
+#Corpus term statistics kept up to date by document ingest and read by the local keyword extractor
+#For every indexed chunk the set of its terms (words and two-word phrases) is recorded, so document frequencies
+#can be adjusted exactly when a chunk is re-indexed or deleted
+#Every add/remove is its own short transaction, so ingest processes running side by side (the job workers) only
+#ever wait for one chunk's write, never for another process's whole ingest
+
+
+WORD = re.compile(r"\w+")
+
+
+def chunk_terms(text):
+    words = WORD.findall(text.lower())
+    terms = set(words)
+    terms.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    return terms
+
+
+class TermStats:
+
+    def __init__(self, path="term_stats.sqlite3"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  #WAL stays consistent, a commit per chunk doesn't fsync
+        self.db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (doc_id TEXT PRIMARY KEY, terms TEXT NOT NULL)")
+        self.db.commit()
+
+    def add_document(self, doc_id, text):
+        with self.lock, self.db:
+            self._remove(doc_id)
+            terms = sorted(chunk_terms(text))
+            self.db.execute("INSERT INTO chunks (doc_id, terms) VALUES (?, ?)", (doc_id, json.dumps(terms)))
+            self.db.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                [(term,) for term in terms],
+            )
+
+    def remove_document(self, doc_id):
+        with self.lock, self.db:
+            self._remove(doc_id)
+
+    def document_count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def document_frequencies(self, terms):
+        terms = list(terms)
+        if not terms:
+            return {}
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(terms))})", terms
+            ).fetchall()
+        return dict(rows)
+
+    def _remove(self, doc_id):
+        row = self.db.execute("SELECT terms FROM chunks WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return
+        terms = [(term,) for term in json.loads(row[0])]
+        self.db.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", terms)
+        self.db.executemany("DELETE FROM terms WHERE term = ? AND df <= 0", terms)
+        self.db.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
@@ -0,0 +1,157 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+#Per-stage latency tracing for the Q&A pipeline
+#A Trace is one question; spans are opened with tracing.span(...) anywhere below it and pick up their parent from a
+#context variable, so Bedrock/OpenSearch helpers don't need a trace argument. Work submitted to a thread pool keeps
+#its parent when it is started with submit_in_context
+#Finished traces are written as JSON lines in OpenTelemetry's span shape and aggregated into p50/p95/p99 per span name
+
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start = time.time_ns()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.time_ns()
+
+    def duration_ms(self):
+        return ((self.end or time.time_ns()) - self.start) / 1e6
+
+
+class NoSpan:
+    #Stand-in when nothing is being traced, so instrumented code doesn't have to check
+
+    def set(self, **attributes):
+        pass
+
+
+class Trace:
+
+    def __init__(self, name="question", **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.root = Span(self, name, None, attributes)
+        self.spans = [self.root]
+
+    def start_span(self, name, parent, attributes):
+        span = Span(self, name, parent.span_id, attributes)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def activate(self):
+        token = current_span.set(self.root)
+        try:
+            yield self.root
+        finally:
+            self.root.finish()
+            current_span.reset(token)
+
+    def waterfall(self):
+        #One row per span, offsets relative to the start of the question
+        return [
+            {
+                "span": span.name,
+                "start_ms": round((span.start - self.root.start) / 1e6, 1),
+                "duration_ms": round(span.duration_ms(), 1),
+                **span.attributes,
+            }
+            for span in sorted(self.spans, key=lambda span: span.start)
+        ]
+
+    def to_otel(self):
+        return [
+            {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "startTimeUnixNano": span.start,
+                "endTimeUnixNano": span.end or time.time_ns(),
+                "attributes": span.attributes,
+            }
+            for span in self.spans
+        ]
+
+
+@contextmanager
+def span(name, **attributes):
+    parent = current_span.get()
+    if parent is None:
+        yield NoSpan()
+        return
+
+    child = parent.trace.start_span(name, parent, attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.set(error=str(e))
+        raise
+    finally:
+        child.finish()
+        current_span.reset(token)
+
+
+def submit_in_context(executor, fn, *args):
+    #executor.submit, but the task runs under the caller's current span
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class TraceRecorder:
+
+    def __init__(self, path=None, window=1000):
+        self.path = path
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: deque(maxlen=window))  #span name -> recent durations in ms
+
+    def record(self, trace):
+        with self.lock:
+            for item in trace.spans:
+                self.durations[item.name].append(item.duration_ms())
+            if self.path:
+                with open(self.path, "a") as f:
+                    for line in trace.to_otel():
+                        f.write(json.dumps(line, default=str) + "\n")
+
+    def percentiles(self):
+        with self.lock:
+            summary = {}
+            for name, durations in self.durations.items():
+                ordered = sorted(durations)
+                summary[name] = {
+                    "count": len(ordered),
+                    "p50_ms": round(nearest_rank(ordered, 50), 1),
+                    "p95_ms": round(nearest_rank(ordered, 95), 1),
+                    "p99_ms": round(nearest_rank(ordered, 99), 1),
+                }
+            return summary
+
+
+def nearest_rank(ordered, percentile):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, -(-percentile * len(ordered) // 100) - 1))]
+
@@ -0,0 +1,155 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from . import resources
+from .retrieval_backends import LocalVectorIndex, OpenSearchBackend
+from .tracing import nearest_rank
+from .vector_storage import STORAGE_BYTES, bytes_per_vector, embedding_model_id, embedding_request, stored_vector
+
+
+#Recall and latency of a compact vector layout against the float index it would replace
+#
+#Online - the same questions are embedded for both layouts and searched on both indexes; recall@k is the share
+#of the float index's top k that the candidate also returns, latency is the kNN search plus, for a split layout,
+#fetching the text of the top passages
+#
+#   python -m compliance_qa.vector_eval --questions questions.txt --baseline-index docs \
+#       --candidate-index docs-byte256 --candidate-content-index docs-text --candidate-storage byte --candidate-dimensions 256
+#
+#Offline - the float vectors of a local index (LOCAL_INDEX_PATH) are quantized here and searched exactly, with
+#sampled chunks as the queries; measures what quantization alone costs, reduced dimensions need the online mode
+#since Titan v2 vectors are new embeddings
+#
+#   python -m compliance_qa.vector_eval --local local_index --queries 500
+
+
+def recall(candidate_ids, baseline_ids):
+    if len(baseline_ids) == 0:
+        return 1.0
+    return len(set(candidate_ids) & set(baseline_ids)) / len(baseline_ids)
+
+
+def summary_line(name, recalls, latencies_ms, vector_bytes=None):
+    ordered = sorted(latencies_ms)
+    line = f"{name:<28} " + (f"{vector_bytes:>6} B/vector" if vector_bytes is not None else " " * 15)
+    if recalls is not None:
+        line += f"  recall@k mean {np.mean(recalls):.3f} min {min(recalls):.3f}"
+    return line + f"  p50 {nearest_rank(ordered, 50):7.2f} ms  p95 {nearest_rank(ordered, 95):7.2f} ms"
+
+
+def embed(bedrock, text, dimensions):
+    response = bedrock.invoke_model(body=json.dumps(embedding_request(text, dimensions)), modelId=embedding_model_id(dimensions),
+                                    accept='application/json', contentType='application/json')
+    return json.loads(response.get('body').read())['embedding']
+
+
+def knn_body(vector, k, fields):
+    return {"size": k, "query": {"knn": {"vectors": {"vector": vector, "k": k}}}, "_source": False, "fields": fields}
+
+
+def evaluate_online(questions, k, top_n, baseline_index, candidate_index, candidate_content_index, storage, dimensions):
+    bedrock, client = resources.bedrock(), resources.opensearch()
+    baseline = OpenSearchBackend(client, baseline_index)
+    candidate = OpenSearchBackend(client, candidate_index, candidate_content_index)
+    fields = ["source", "page"] if candidate_content_index else ["content", "source", "page"]
+    recalls, baseline_ms, candidate_ms, fetch_ms = [], [], [], []
+
+    for question in questions:
+        baseline_vector = embed(bedrock, question, 1536)
+        started = time.perf_counter()
+        baseline_hits = baseline.search(knn_body(baseline_vector, k, ["source", "page"]))["hits"]["hits"]
+        baseline_ms.append((time.perf_counter() - started) * 1000)
+
+        candidate_vector = stored_vector(embed(bedrock, question, dimensions), storage)
+        started = time.perf_counter()
+        candidate_hits = candidate.search(knn_body(candidate_vector, k, fields))["hits"]["hits"]
+        candidate_ms.append((time.perf_counter() - started) * 1000)
+        if candidate_content_index:
+            started = time.perf_counter()
+            candidate.contents([hit["_id"] for hit in candidate_hits[:top_n]])
+            fetch_ms.append((time.perf_counter() - started) * 1000)
+
+        recalls.append(recall([hit["_id"] for hit in candidate_hits], [hit["_id"] for hit in baseline_hits]))
+
+    print(f"{len(questions)} questions, k={k}")
+    print(summary_line(f"{baseline_index} (float, 1536)", None, baseline_ms, bytes_per_vector(1536, 'float')))
+    print(summary_line(f"{candidate_index} ({storage}, {dimensions})", recalls, candidate_ms, bytes_per_vector(dimensions, storage)))
+    if fetch_ms:
+        print(summary_line(f"  + text of top {top_n}", None, fetch_ms))
+        print(summary_line("  = total", None, [a + b for a, b in zip(candidate_ms, fetch_ms)]))
+
+
+def evaluate_local(path, queries, k, seed):
+    index = LocalVectorIndex(path)
+    live = [row for row in range(index.count) if row not in index.deleted]
+    if not live:
+        raise SystemExit(f"No vectors in {path}")
+    vectors = np.asarray(index.vectors[live], dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)
+    dimensions = vectors.shape[1]
+
+    def search(matrix, query, exclude):
+        #Exact l2 search, the query's own chunk left out
+        distances = ((matrix - query) ** 2).sum(axis=1)
+        distances[exclude] = np.inf
+        top = np.argpartition(distances, k)[:k]
+        return top[np.argsort(distances[top])].tolist()
+
+    layouts = {
+        "float": (vectors, lambda vector: vector),
+        "fp16": (vectors.astype(np.float16).astype(np.float32), lambda vector: vector.astype(np.float16).astype(np.float32)),
+        "byte": (np.array([stored_vector(vector, 'byte') for vector in vectors], dtype=np.float32),
+                 lambda vector: np.asarray(stored_vector(vector, 'byte'), dtype=np.float32)),
+    }
+    k = min(k, len(vectors) - 1)
+    if k < 1:
+        raise SystemExit(f"Need at least 2 vectors in {path}")
+
+    results = {}
+    for name, (matrix, quantize) in layouts.items():
+        found, latencies = [], []
+        for row in query_rows:
+            started = time.perf_counter()
+            found.append(search(matrix, quantize(vectors[row]), row))
+            latencies.append((time.perf_counter() - started) * 1000)
+        results[name] = (found, latencies)
+
+    print(f"{len(vectors)} vectors of {dimensions} dimensions, {len(query_rows)} queries, k={k}, exact search")
+    baseline = results["float"][0]
+    for name, (found, latencies) in results.items():
+        recalls = [recall(candidate, expected) for candidate, expected in zip(found, baseline)]
+        print(summary_line(name, recalls, latencies, dimensions * STORAGE_BYTES[name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency of quantized or reduced-dimension vectors against the float index")
+    parser.add_argument("-k", type=int, default=5, help="kNN hits compared per question (Q&A asks for 5)")
+    parser.add_argument("--local", help="offline: local index directory whose float vectors are quantized and compared")
+    parser.add_argument("--queries", type=int, default=200, help="offline: chunks sampled as queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--questions", help="online: file with one question per line")
+    parser.add_argument("--baseline-index", default=resources.INDEX_NAME, help="online: the float, 1536 dimension index")
+    parser.add_argument("--candidate-index", help="online: the compact index")
+    parser.add_argument("--candidate-content-index", help="online: the candidate's content index, if split")
+    parser.add_argument("--candidate-storage", choices=list(STORAGE_BYTES), default="byte")
+    parser.add_argument("--candidate-dimensions", type=int, default=1536)
+    parser.add_argument("--top-n", type=int, default=8, help="online: passages whose text a split layout fetches")
+    args = parser.parse_args()
+
+    if args.local:
+        evaluate_local(args.local, args.queries, args.k, args.seed)
+    elif args.questions and args.candidate_index:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        evaluate_online(questions, args.k, args.top_n, args.baseline_index, args.candidate_index,
+                        args.candidate_content_index, args.candidate_storage, args.candidate_dimensions)
+    else:
+        parser.error("give --local, or --questions and --candidate-index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+from . import resources
+
+
+#Layout of the AOSS indexes that ingest writes and Q&A searches
+#
+#VECTOR_STORAGE - 'float' keeps the 32-bit vectors as they have always been; 'fp16' has the faiss engine store them
+#as 16-bit floats (half the memory, vectors are sent unchanged); 'byte' stores 8-bit integers (a quarter), the unit
+#length vector scaled so BYTE_CLIP_SIGMAS standard deviations of a component fill -127..127
+#EMBEDDING_DIMENSIONS - 1536 is Titan v1; 1024, 512 or 256 use Titan v2's reduced-dimension embeddings
+#CONTENT_INDEX_NAME (resources) - when set, chunk text goes to that index and the vector index only keeps vectors,
+#source and page; kNN hits come back without text and Q&A fetches it for the final top passages only
+#
+#Changing any of these needs new indexes (python -m compliance_qa.vector_storage --create) and a re-ingest; the
+#ingest manifest hashes include the layout, so a re-ingest re-indexes every chunk. vector_eval measures the
+#recall/latency tradeoff before switching
+
+
+VECTOR_STORAGE = os.environ.get('VECTOR_STORAGE', 'float')
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', '1536'))
+BYTE_CLIP_SIGMAS = 6
+
+STORAGE_BYTES = {'float': 4, 'fp16': 2, 'byte': 1}
+TITAN_V2_DIMENSIONS = (1024, 512, 256)
+
+if VECTOR_STORAGE not in STORAGE_BYTES:
+    raise ValueError(f"VECTOR_STORAGE must be one of {', '.join(STORAGE_BYTES)}, not {VECTOR_STORAGE}")
+if EMBEDDING_DIMENSIONS != 1536 and EMBEDDING_DIMENSIONS not in TITAN_V2_DIMENSIONS:
+    raise ValueError(f"EMBEDDING_DIMENSIONS must be 1536 (Titan v1) or one of {TITAN_V2_DIMENSIONS} (Titan v2)")
+
+
+def embedding_model_id(dimensions=EMBEDDING_DIMENSIONS):
+    return 'amazon.titan-embed-text-v1' if dimensions == 1536 else 'amazon.titan-embed-text-v2:0'
+
+
+def embedding_cache_id(dimensions=EMBEDDING_DIMENSIONS):
+    #Embedding cache key prefix - Titan v2 vectors of different sizes are different embeddings
+    model_id = embedding_model_id(dimensions)
+    return model_id if dimensions == 1536 else f"{model_id}/{dimensions}"
+
+
+def embedding_request(text, dimensions=EMBEDDING_DIMENSIONS):
+    if dimensions == 1536:
+        return {"inputText": text}
+    return {"inputText": text, "dimensions": dimensions, "normalize": True}
+
+
+def layout_id():
+    #Part of the ingest manifest's content hashes; the default layout keeps the hashes it always had
+    parts = [embedding_cache_id()]
+    if VECTOR_STORAGE != 'float':
+        parts.append(VECTOR_STORAGE)
+    if resources.CONTENT_INDEX_NAME:
+        parts.append('split')
+    return "/".join(parts)
+
+
+def stored_vector(vector, storage=VECTOR_STORAGE):
+    #The vector as it is sent to the index, for documents and kNN queries alike
+    if storage != 'byte':
+        return vector
+    vector = np.asarray(vector, dtype=np.float32)
+    scale = 127 * math.sqrt(len(vector)) / BYTE_CLIP_SIGMAS / (np.linalg.norm(vector) or 1)
+    return np.clip(np.rint(vector * scale), -127, 127).astype(int).tolist()
+
+
+def vector_mapping(dimensions=EMBEDDING_DIMENSIONS, storage=VECTOR_STORAGE):
+    method = {"name": "hnsw", "engine": "faiss", "space_type": "l2", "parameters": {"ef_construction": 256, "m": 16}}
+    mapping = {"type": "knn_vector", "dimension": dimensions, "method": method}
+    if storage == 'fp16':
+        method["parameters"]["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+    elif storage == 'byte':
+        mapping["data_type"] = "byte"
+    return mapping
+
+
+def index_bodies(dimensions=EMBEDDING_DIMENSIONS, storage=VECTOR_STORAGE, split=None):
+    #{index name: create body} for the configured layout
+    split = bool(resources.CONTENT_INDEX_NAME) if split is None else split
+    fields = {"source": {"type": "keyword"}, "page": {"type": "keyword"}}
+    vector_index = {
+        "settings": {"index": {"knn": True}},
+        "mappings": {"properties": dict(fields, vectors=vector_mapping(dimensions, storage))},
+    }
+    if not split:
+        vector_index["mappings"]["properties"]["content"] = {"type": "text"}
+        return {resources.INDEX_NAME: vector_index}
+
+    #Vectors live in the kNN graph, a second copy in _source would only be read back by a reindex
+    vector_index["mappings"]["_source"] = {"excludes": ["vectors"]}
+    content_index = {"mappings": {"properties": dict(fields, content={"type": "text"})}}
+    return {resources.INDEX_NAME: vector_index, resources.CONTENT_INDEX_NAME: content_index}
+
+
+def bytes_per_vector(dimensions=EMBEDDING_DIMENSIONS, storage=VECTOR_STORAGE):
+    return dimensions * STORAGE_BYTES[storage]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print or create the AOSS indexes for the configured vector layout")
+    parser.add_argument("--create", action="store_true", help="create the indexes instead of printing their bodies")
+    args = parser.parse_args()
+
+    bodies = index_bodies()
+    for name, body in bodies.items():
+        if args.create:
+            resources.opensearch().indices.create(index=name, body=body)
+            print(f"Created {name}")
+        else:
+            print(f"PUT {name}\n{json.dumps(body, indent=2)}\n")
+    print(f"{bytes_per_vector()} bytes per vector ({EMBEDDING_DIMENSIONS} dimensions, {VECTOR_STORAGE})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import numpy as np
+
+from compliance_qa.answer_cache import INITIAL_CAPACITY, AnswerCache
+
+
+def vectors(count, dimensions=1536, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+
+
+def test_the_index_grows_with_the_entries_and_finds_each_one(tmp_path):
+    cache = AnswerCache(str(tmp_path / "cache.sqlite3"))
+    questions = vectors(INITIAL_CAPACITY + 10)
+    for i, vector in enumerate(questions):
+        cache.put(vector, f"question {i}", f"answer {i}", [f"source {i}"])
+
+    assert cache.capacity == 2 * INITIAL_CAPACITY
+    assert cache.stats()["entries"] == len(questions)
+    for i in range(0, len(questions), 97):
+        assert cache.get(questions[i] + 0.01 * vectors(1, seed=i + 1)[0]) == f"answer {i}"
+    assert cache.get(vectors(1, seed=5000)[0]) is None
+
+
+def test_a_full_cache_evicts_the_least_recently_used_entry(tmp_path):
+    cache = AnswerCache(str(tmp_path / "cache.sqlite3"), max_entries=3)
+    questions = vectors(4)
+    for i, vector in enumerate(questions[:3]):
+        cache.put(vector, f"question {i}", f"answer {i}", [])
+    assert cache.get(questions[0]) == "answer 0"
+
+    cache.put(questions[3], "question 3", "answer 3", [])
+    assert cache.capacity == 3
+    assert cache.get(questions[1]) is None
+    assert [cache.get(questions[i]) for i in (0, 2, 3)] == ["answer 0", "answer 2", "answer 3"]
@@ -0,0 +1,54 @@
+from opensearchpy.exceptions import TransportError
+
+from compliance_qa.bulk_indexer import BulkIndexer
+
+
+class ThrottlingClient:
+    #Answers each _bulk with the next scripted list of item statuses, or raises the next scripted error
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def bulk(self, body):
+        self.requests.append(body)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return {"items": [{"index": {"status": status}} for status in response]}
+
+
+def indexed_ids(body):
+    return [line["index"]["_id"] for line in body if "index" in line]
+
+
+def run(client, count, **options):
+    reports = []
+    with BulkIndexer(client, "docs", report=lambda label, ok, info: reports.append((label, ok)), initial_backoff=0, **options) as indexer:
+        for i in range(count):
+            indexer.add({"content": f"chunk {i}"}, f"Page: {i}", doc_id=f"doc{i}")
+    return reports
+
+
+def test_only_the_throttled_items_are_resent():
+    client = ThrottlingClient([201, 429, 201], [429], [201])
+    reports = run(client, 3)
+
+    assert [indexed_ids(body) for body in client.requests] == [["doc0", "doc1", "doc2"], ["doc1"], ["doc1"]]
+    assert sorted(reports) == [("Page: 0", True), ("Page: 1", True), ("Page: 2", True)]
+
+
+def test_a_throttled_request_is_retried_and_other_errors_are_reported():
+    client = ThrottlingClient(TransportError(429, "too_many_requests"), [201, 400])
+    reports = run(client, 2)
+
+    assert len(client.requests) == 2
+    assert reports == [("Page: 0", True), ("Page: 1", False)]
+
+
+def test_items_still_throttled_after_the_last_retry_are_reported_as_failed():
+    client = ThrottlingClient([429], [429], [429])
+    reports = run(client, 1, max_retries=2)
+
+    assert len(client.requests) == 3
+    assert reports == [("Page: 0", False)]
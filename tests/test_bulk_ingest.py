@@ -0,0 +1,76 @@
+import os
+import zipfile
+
+import pytest
+
+from compliance_qa import bulk_ingest, ingest, jobs, resources
+from compliance_qa.ingest_manifest import IngestManifest
+from compliance_qa.term_stats import TermStats
+
+
+class IndexingClient:
+    #_bulk that accepts every item, keeping what is in the index by id
+
+    def __init__(self):
+        self.documents = {}
+
+    def bulk(self, body):
+        items = []
+        position = 0
+        while position < len(body):
+            operation, meta = next(iter(body[position].items()))
+            if operation == "delete":
+                self.documents.pop(meta["_id"], None)
+                position += 1
+            else:
+                self.documents[meta["_id"]] = body[position + 1]
+                position += 2
+            items.append({operation: {"_id": meta["_id"], "status": 201}})
+        return {"items": items}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    client = IndexingClient()
+    monkeypatch.setenv("ANSWER_CACHE_PATH", str(tmp_path / "answer_cache.sqlite3"))
+    monkeypatch.setattr(resources, "opensearch", lambda: client)
+    monkeypatch.setattr(resources, "bedrock", lambda: None)
+    monkeypatch.setattr(resources, "term_stats", lambda: TermStats(str(tmp_path / "term_stats.sqlite3")))
+    monkeypatch.setattr(ingest, "get_embeddings", lambda bedrock, text: [float(len(text)), 1.0])
+    monkeypatch.setattr(ingest, "local_index", lambda: None)
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+    monkeypatch.setattr(ingest, "manifest", lambda: manifest)
+    return client
+
+
+def test_files_with_the_same_name_in_two_folders_are_indexed_apart(tmp_path, client):
+    corpus = tmp_path / "corpus"
+    for folder in ("a", "b"):
+        os.makedirs(corpus / folder)
+        (corpus / folder / "notes.txt").write_text(f"Notes kept in folder {folder} about trade reporting.")
+
+    summary = bulk_ingest.ingest_paths([str(corpus)], parse_workers=0, progress=lambda message: None)
+
+    assert summary["embedded"] == summary["indexed"] == 2
+    assert sorted(document["content"] for document in client.documents.values()) == [
+        "Notes kept in folder a about trade reporting.", "Notes kept in folder b about trade reporting."]
+    manifest = ingest.manifest()
+    assert len(manifest.chunks_for("corpus/a/notes.txt")) == len(manifest.chunks_for("corpus/b/notes.txt")) == 1
+
+    summary = bulk_ingest.ingest_paths([str(corpus)], parse_workers=0, progress=lambda message: None)
+    assert (summary.get("unchanged", 0), summary.get("embedded", 0), summary.get("deleted", 0)) == (2, 0, 0)
+    assert len(client.documents) == 2
+
+
+def test_an_archive_job_logs_the_summary_and_counts_the_chunks_of_its_files(tmp_path, client):
+    archive = str(tmp_path / "upload.zip")
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("policies/notes.txt", "Trade reporting notes.")
+        zip_file.writestr("rules.txt", "Validation rules.")
+    messages = []
+
+    ingest.process_files(archive, "rules-2024.zip", "Archive", progress=messages.append)
+
+    assert any(message.startswith("Files: 2 indexed") and "embeddings/sec" in message for message in messages)
+    assert jobs.indexed_chunks({"file_type": "Archive", "original_file_name": "rules-2024.zip"}) == 2
+    assert jobs.indexed_chunks({"file_type": "Text", "original_file_name": "rules-2024.zip/rules.txt"}) == 1
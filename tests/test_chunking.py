@@ -0,0 +1,34 @@
+from compliance_qa.chunking import sliding_windows
+
+
+def numbered_sentences(count):
+    return " ".join(f"Sentence {i} is about article {i} of the regulation." for i in range(count))
+
+
+def test_windows_stay_under_the_token_budget_and_cover_the_text_in_order():
+    text = numbered_sentences(400)
+    chunks = list(sliding_windows([text], max_tokens=100, overlap_tokens=20))
+
+    assert len(chunks) > 1
+    assert all(len(chunk) / 4 <= 100 for chunk in chunks)
+    assert chunks[0].startswith("Sentence 0 ")
+    assert chunks[-1].endswith("article 399 of the regulation.")
+    positions = [text.index(chunk) for chunk in chunks]
+    assert all(previous < position for previous, position in zip(positions, positions[1:]))
+
+
+def test_consecutive_windows_overlap_and_end_on_a_sentence():
+    chunks = list(sliding_windows([numbered_sentences(400)], max_tokens=100, overlap_tokens=20))
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.endswith(".")
+        first_sentence = chunk.split(".")[0] + "."
+        assert first_sentence in previous
+
+
+def test_pieces_do_not_run_into_each_other_and_long_words_are_split():
+    chunks = list(sliding_windows(["end of page one", "start of page two", "x" * 1000], max_tokens=50, overlap_tokens=0))
+
+    assert chunks[0].startswith("end of page one\nstart of page two")
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert sum(chunk.count("x") for chunk in chunks) == 1000
@@ -0,0 +1,80 @@
+import random
+
+import pandas as pd
+from openpyxl import Workbook
+
+from compliance_qa.excel_chunker import iter_blocks, read_sheet_batches, row_strings
+
+
+def original_blocks(file_name, max_length):
+    #The row-by-row loop process_excel used before excel_chunker, {sheet name: blocks}
+    xls = pd.ExcelFile(file_name)
+    blocks = {}
+    for sheet_name in xls.sheet_names:
+        df = pd.read_excel(xls, sheet_name=sheet_name)
+        header = ' '.join(df.columns.astype(str))
+        rows = df.astype(str).apply(lambda x: ' '.join(x.dropna().values), axis=1).tolist()
+
+        content_blocks = []
+        current_block = header
+        for row in rows:
+            if len(current_block) + len(row) + 1 < max_length:
+                current_block += " " + row
+            else:
+                content_blocks.append(current_block)
+                current_block = header + " " + row
+        if current_block:
+            content_blocks.append(current_block)
+        blocks[sheet_name] = content_blocks
+    return blocks
+
+
+def random_value(rng):
+    kind = rng.random()
+    if kind < 0.1:
+        return None
+    if kind < 0.3:
+        return rng.randint(-1000, 100000)
+    if kind < 0.4:
+        return round(rng.uniform(-100, 100), rng.randint(0, 4))
+    return " ".join(rng.choice(["EMIR", "trade", "report", "NCA", "rejected", "Article 9", "T+1", "LEI"])
+                    for _ in range(rng.randint(1, rng.choice([3, 30, 300]))))
+
+
+def write_random_workbook(path, rng):
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for sheet_number in range(rng.randint(1, 3)):
+        sheet = workbook.create_sheet(f"Sheet{sheet_number}")
+        width = rng.randint(1, 6)
+        header = [rng.choice(["Rule", "Field", "Description", "Owner"]) for _ in range(width)]
+        sheet.append(header)
+        for _ in range(rng.randint(0, 400)):
+            row = [random_value(rng) for _ in range(width)]
+            row[0] = row[0] if row[0] is not None else "x"  #a row with no values at all is skipped by both readers
+            sheet.append(row)
+    workbook.save(path)
+
+
+def test_blocks_match_the_original_row_by_row_loop_on_random_workbooks(tmp_path):
+    rng = random.Random(0)
+    for workbook_number in range(25):
+        path = str(tmp_path / f"random{workbook_number}.xlsx")
+        write_random_workbook(path, rng)
+        max_length = rng.choice([50, 300, 2000, 20000])
+
+        expected = original_blocks(path, max_length)
+        actual = {sheet_name: list(iter_blocks(header, row_batches, max_length))
+                  for sheet_name, header, row_batches in read_sheet_batches(path, batch_rows=rng.randint(1, 150))}
+        assert actual == expected, path
+
+
+def test_row_strings_match_the_original_apply():
+    rng = random.Random(1)
+    df = pd.DataFrame({
+        "text": [random_value(rng) for _ in range(200)],
+        "number": [rng.randint(0, 50) for _ in range(200)],
+        "mixed": [random_value(rng) for _ in range(200)],
+    })
+    expected = df.astype(str).apply(lambda x: ' '.join(x.dropna().values), axis=1).tolist()
+    assert list(row_strings(df)) == expected
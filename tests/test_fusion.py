@@ -0,0 +1,33 @@
+import pytest
+
+from compliance_qa.fusion import hits_from_response, reciprocal_rank_fusion
+
+
+def hit(doc_id, content="text"):
+    return {"id": doc_id, "score": 1.0, "content": content, "source": "rules.pdf", "page": 1}
+
+
+def test_documents_found_by_several_searches_rank_above_a_single_first_place():
+    semantic = [hit("a"), hit("b"), hit("c")]
+    keyword = [hit("b"), hit("c"), hit("b")]  #a repeat within one list only counts once
+
+    fused = reciprocal_rank_fusion([semantic, keyword], weights=[1.5, 1.0], k=60)
+
+    assert [entry["id"] for entry in fused] == ["b", "c", "a"]
+    scores = {entry["id"]: entry["rrf_score"] for entry in fused}
+    assert scores["b"] == pytest.approx(1.5 / 62 + 1.0 / 61)
+    assert scores["a"] == pytest.approx(1.5 / 61)
+
+
+def test_hits_without_text_take_it_from_another_search():
+    fused = reciprocal_rank_fusion([[hit("a", content="")], [hit("a", content="keyword text")]])
+    assert fused[0]["content"] == "keyword text"
+
+
+def test_knn_fields_and_keyword_source_become_the_same_hits():
+    knn = {"hits": {"hits": [{"_id": "a", "_score": 0.9, "fields": {"content": ["x"], "source": ["s.pdf"], "page": [3]}}]}}
+    keyword = {"hits": {"hits": [{"_id": "a", "_score": 7.1, "_source": {"content": "x", "source": "s.pdf", "page": 3}}]}}
+
+    for response in (knn, keyword):
+        [parsed] = hits_from_response(response)
+        assert (parsed["id"], parsed["content"], parsed["source"], parsed["page"]) == ("a", "x", "s.pdf", 3)
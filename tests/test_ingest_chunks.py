@@ -0,0 +1,52 @@
+from openpyxl import Workbook
+
+from compliance_qa import ingest
+from compliance_qa.chunking import CHUNK_TOKENS
+
+
+def write_workbook(path, rows, long_row=None):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Rules"
+    sheet.append(["Name", "Description", "Threshold"])
+    for i in range(rows):
+        sheet.append([f"row{i}", f"validation rule number {i} here", i])
+    if long_row is not None:
+        sheet.append(["long", long_row, 0])
+    workbook.save(path)
+
+
+def test_every_excel_chunk_starts_with_the_sheet_header(tmp_path):
+    path = str(tmp_path / "rules.xlsx")
+    write_workbook(path, 3000)
+
+    chunks = list(ingest.iter_excel_chunks(path, "rules.xlsx"))
+
+    assert len(chunks) > 1
+    for content, source, page_number, chunk_index, label in chunks:
+        assert content.startswith("Name Description Threshold row")
+        assert len(content) <= CHUNK_TOKENS * 4
+        assert source == "rules.xlsx - Rules"
+        assert page_number == "Rules"
+    assert [chunk[3] for chunk in chunks] == list(range(len(chunks)))
+
+
+def test_excel_rows_are_not_split_or_repeated_across_chunks(tmp_path):
+    path = str(tmp_path / "rules.xlsx")
+    write_workbook(path, 3000)
+
+    contents = [chunk[0] for chunk in ingest.iter_excel_chunks(path, "rules.xlsx")]
+
+    assert sum(content.count("validation rule number") for content in contents) == 3000
+    assert "validation rule number 2999 here 2999" in contents[-1]
+
+
+def test_a_row_longer_than_a_chunk_is_windowed_on_its_own(tmp_path):
+    path = str(tmp_path / "rules.xlsx")
+    write_workbook(path, 10, long_row="word " * (CHUNK_TOKENS * 2))
+
+    chunks = [chunk[0] for chunk in ingest.iter_excel_chunks(path, "rules.xlsx")]
+
+    assert chunks[0].startswith("Name Description Threshold row0")
+    assert all(len(chunk) <= CHUNK_TOKENS * 4 for chunk in chunks)
+    assert len(chunks) > 2
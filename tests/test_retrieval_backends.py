@@ -0,0 +1,80 @@
+import numpy as np
+from opensearchpy.exceptions import ConnectionTimeout, NotFoundError, TransportError
+
+from compliance_qa.retrieval_backends import LocalVectorBackend, LocalVectorIndex, OpenSearchBackend
+
+
+def knn_query(vector, k):
+    return {"size": k, "query": {"knn": {"vectors": {"vector": list(vector), "k": k}}}}
+
+
+def test_a_reader_sees_what_the_writer_persisted_without_the_deleted_records(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((20, 8))
+    writer = LocalVectorIndex(str(tmp_path))
+    for i, vector in enumerate(vectors):
+        writer.add(f"doc{i}", vector, f"text {i}", "rules.pdf", i)
+    writer.delete("doc3")
+    writer.persist()
+
+    backend = LocalVectorBackend(LocalVectorIndex(str(tmp_path)))
+    hits = backend.search(knn_query(vectors[3], 2))["hits"]["hits"]
+    assert "doc3" not in [hit["_id"] for hit in hits]
+    hits = backend.search(knn_query(vectors[7], 1))["hits"]["hits"]
+    assert [(hit["_id"], hit["fields"]["content"]) for hit in hits] == [("doc7", ["text 7"])]
+
+    writer.add("doc20", vectors[7] + 0.001, "text 20", "rules.pdf", 20)
+    writer.persist()
+    hits = backend.search(knn_query(vectors[7], 2))["hits"]["hits"]
+    assert sorted(hit["_id"] for hit in hits) == ["doc20", "doc7"]
+    assert {hit["_id"]: hit["fields"]["content"][0] for hit in hits}["doc20"] == "text 20"
+
+
+def test_ids_and_keyword_queries_return_the_matching_documents(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.add("a", [1.0, 0.0], "reporting deadline for EMIR trades", "emir.pdf", 1)
+    index.add("b", [0.0, 1.0], "capital requirements", "crr.pdf", 2)
+    backend = LocalVectorBackend(index)
+
+    hits = backend.search({"size": 5, "query": {"ids": {"values": ["b", "missing"]}}})["hits"]["hits"]
+    assert [(hit["_id"], hit["_source"]["source"]) for hit in hits] == [("b", "crr.pdf")]
+    hits = backend.search({"size": 5, "query": {"bool": {"should": [{"match": {"content": "EMIR deadline"}}]}}})["hits"]["hits"]
+    assert [hit["_id"] for hit in hits] == ["a"]
+
+
+class FlakyMsearchClient:
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def msearch(self, body, index):
+        self.calls.append("msearch")
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"responses": [{"hits": {"hits": [{"_id": query["size"]}]}} for query in body[1::2]]}
+
+    def search(self, body, index):
+        self.calls.append("search")
+        return {"hits": {"hits": [{"_id": body["size"]}]}}
+
+
+def test_msearch_is_disabled_only_when_the_collection_does_not_support_it():
+    client = FlakyMsearchClient(ConnectionTimeout("TIMEOUT", "read timed out", None), TransportError(429, "too_many_requests"))
+    backend = OpenSearchBackend(client, "docs")
+    bodies = [{"size": 1, "query": {"match_all": {}}}, {"size": 2, "query": {"match_all": {}}}]
+
+    for _ in range(2):
+        assert [response["hits"]["hits"][0]["_id"] for response in backend.msearch(bodies)] == [1, 2]
+    assert backend.msearch_available
+    assert client.calls == ["msearch", "search", "search"] * 2
+
+    client.calls.clear()
+    backend.msearch(bodies)
+    assert client.calls == ["msearch"]
+
+    client = FlakyMsearchClient(NotFoundError(404, "no handler found for uri [/docs/_msearch]"))
+    backend = OpenSearchBackend(client, "docs")
+    backend.msearch(bodies)
+    backend.msearch(bodies)
+    assert not backend.msearch_available
+    assert client.calls == ["msearch", "search", "search", "search", "search"]
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import httpx
+
+from compliance_qa import qa, service
+
+
+def ask_all(questions, max_concurrent, max_queued, release):
+    async def run():
+        service.app.state.runner = service.QuestionRunner(max_concurrent, max_queued)
+        transport = httpx.ASGITransport(app=service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            requests = [asyncio.create_task(client.post("/ask", json={"question": question})) for question in questions]
+            await asyncio.sleep(0.2)  #every request admitted or rejected, the admitted ones holding their slots
+            release.set()
+            responses = await asyncio.gather(*requests)
+        service.app.state.runner.shutdown()
+        return [response.status_code for response in responses]
+
+    return asyncio.run(run())
+
+
+def blocking_pipeline(monkeypatch):
+    release = threading.Event()
+
+    def do_it_stream(question, trace=None):
+        release.wait(5)
+        yield f"answer to {question}"
+
+    monkeypatch.setattr(qa, "do_it_stream", do_it_stream)
+    return release
+
+
+def test_a_question_on_an_idle_server_runs_without_a_queue(monkeypatch):
+    release = blocking_pipeline(monkeypatch)
+    assert ask_all(["what is due in march"], max_concurrent=1, max_queued=0, release=release) == [200]
+
+
+def test_a_burst_fills_the_free_slots_and_the_queue_before_rejecting(monkeypatch):
+    release = blocking_pipeline(monkeypatch)
+    statuses = ask_all([f"question {i}" for i in range(6)], max_concurrent=2, max_queued=1, release=release)
+    assert sorted(statuses) == [200, 200, 200, 503, 503, 503]
+
+
+def test_identical_questions_share_one_run_and_are_not_counted_twice(monkeypatch):
+    release = blocking_pipeline(monkeypatch)
+    statuses = ask_all(["same question"] * 5, max_concurrent=1, max_queued=0, release=release)
+    assert statuses == [200] * 5
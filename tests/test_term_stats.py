@@ -0,0 +1,18 @@
+import sqlite3
+
+from compliance_qa.term_stats import TermStats
+
+
+def test_writes_are_committed_per_document_so_other_processes_are_not_locked_out(tmp_path):
+    path = str(tmp_path / "term_stats.sqlite3")
+    first, second = TermStats(path), TermStats(path)
+
+    first.add_document("a", "annual filing deadline")
+    #A second writer must get the write lock straight away, not after the first ingest finishes
+    second.db.execute("PRAGMA busy_timeout = 0")
+    second.add_document("b", "filing fees")
+    first.remove_document("a")
+
+    assert second.document_count() == 1
+    assert second.document_frequencies(["filing", "deadline", "fees"]) == {"filing": 1, "fees": 1}
+    assert sqlite3.connect(path).execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 1